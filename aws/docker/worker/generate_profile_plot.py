@@ -1,28 +1,75 @@
 import matplotlib
 import matplotlib.style as mplstyle
 import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import boto3
 import botocore
 import cmocean
+import hashlib
 import io
+import json
 import logging
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import numpy.ma as ma
 import os
 import pandas as pd
-from typing import Tuple
-import urllib.error
+import tempfile
+import time
 import traceback
-from datetime import datetime
 from httpx import HTTPError
 from erddapy import ERDDAP
+try:
+    # Parquet engine of the observation store
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 
 __version__ = '0.3.0'
 matplotlib.use('AGG')
 mplstyle.use('fast')
 
+# Plots with at least this many observations are drawn as a binned image
+# rather than one scatter marker per observation
+RASTER_MIN_POINTS = int(os.environ.get('PLOT_RASTER_MIN_POINTS', 100000))
+# Time and depth bins of the binned image, roughly one bin per pixel of the
+# plot area of a 20x5 inch figure
+RASTER_BINS = (1500, 400)
+# Empty bins within this many bins of an observation take the mean of their
+# neighbours, about the radius of a default scatter marker
+RASTER_FILL = 4
+
+# Number of parameters rendered at once and whether they're rendered in
+# forked 'process'es or one after another ('serial'). Threads aren't an
+# option: Agg holds the GIL while drawing and the font cache of the pinned
+# matplotlib isn't thread safe.
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS', 4))
+PLOT_EXECUTOR = os.environ.get('PLOT_EXECUTOR', 'process')
+
+# Directory of the per-deployment observation store, requires pyarrow. When
+# unset every plot cycle downloads the whole dataset.
+OBSERVATION_STORE_DIR = os.environ.get('OBSERVATION_STORE_DIR')
+# Seconds after which a deployment's stored observations are fetched in full
+# again, to pick up values ERDDAP changed without changing the row count
+OBSERVATION_STORE_MAX_AGE = int(os.environ.get('OBSERVATION_STORE_MAX_AGE', 7 * 24 * 60 * 60))
+
+# Per-deployment record of the rendered plots and the data they were rendered
+# from, stored next to the plots
+MANIFEST_NAME = 'manifest.json'
+
+ERDDAP_VARIABLES = [
+    'depth',
+    'latitude',
+    'longitude',
+    'salinity',
+    'temperature',
+    'conductivity',
+    'density',
+    'time',
+]
+
 PARAMETERS = {
 
     'salinity': {
@@ -44,73 +91,137 @@ PARAMETERS = {
 }
 
 
-def generate_profile_plot(erddap_dataset):
+def generate_profile_plot(erddap_dataset, time_extents=None, checksum=None):
     '''
-    Plot the parameters for a deployment
+    Plot the parameters for a deployment. Plots are only rendered when the
+    fingerprint of the deployment's data, or the plotting version, differs
+    from the one recorded in the deployment's manifest.
     :param str erddap_dataset: ERDDAP endpoint
+    :param tuple time_extents: Optional (min, max) ISO 8601 time strings of the
+                               dataset, e.g. from the allDatasets catalog. Used
+                               to skip fetches from the observation store.
+    :param str checksum: DAC checksum of the deployment's files. A change
+                         re-renders the plots and checks the stored
+                         observations against ERDDAP's row count.
     '''
     dataset_id = erddap_dataset.split('/')[-1].split('.html')[0]
-    time_min, time_max = check_time_min_max(dataset_id)
 
     s3 = boto3.resource('s3')
     S3_BUCKET = os.environ.get('AWS_S3_BUCKET', 'ioos-glider-plots')
-    bucket = s3.Bucket(S3_BUCKET)
-
 
-    df = get_erddap_data(dataset_id)
+    df = get_observations(dataset_id, time_extents, checksum=checksum)
     if df is None:
         return
+    fingerprint = data_fingerprint(df, checksum)
+    manifest = load_manifest(s3, S3_BUCKET, dataset_id)
+    if manifest.get('version') != __version__:
+        manifest = {'plots': {}}
+    manifest['version'] = __version__
 
+    parameters = []
     for parameter in PARAMETERS:
-        title = f"{dataset_id} {parameter.title()} Profiles"
+        if manifest['plots'].get(parameter, {}).get('fingerprint') == fingerprint:
+            logging.info(f"Data of previous {parameter} plot for {dataset_id} unchanged, skipping.")
+        else:
+            parameters.append(parameter)
+    if not parameters:
+        return
+
+    # Parsed once for all of the parameters
+    frame = ProfileFrame(df)
+    images = render_plots(dataset_id, frame, parameters)
+    for parameter in parameters:
+        if isinstance(images[parameter], Exception):
+            logging.error("Failed to generate plot for {}, dataset = {}".format(parameter, dataset_id),
+                          exc_info=images[parameter])
+            continue
         filename = '{}/{}.png'.format(dataset_id, parameter)
         try:
-            graph_obj = s3.Object(S3_BUCKET, filename)
-            graph_obj.load()
-        # catch all here instead of using botocore.exceptions.ClientError
-        # if we can't access an object and it later fails to write
-        # the graph image we'll want to throw an exception anyhow
-        except botocore.exceptions.ClientError:
-            logging.exception("Failed attempting to fetch object for time min/max determination, "
-                              "file possibly did not exist prior to this call")
-            try:
-                plot_from_pd(title, df, parameter, graph_obj, time_min, time_max)
-            except:
-                logging.exception("Failed to generate plot for {}, dataset = {}".format(parameter, dataset_id))
-                traceback.print_exc()
-        # TODO: Add further levels of cache invalidation in case dataset is reuploaded,
-        #       removed, etc.
+            put_plot(s3.Object(S3_BUCKET, filename), images[parameter],
+                     fingerprint['min_time'] or '', fingerprint['max_time'] or '')
+        except:
+            logging.exception("Failed to upload plot for {}, dataset = {}".format(parameter, dataset_id))
+            traceback.print_exc()
         else:
-            if (graph_obj.metadata.get("min_time") != time_min or
-                graph_obj.metadata.get("max_time") != time_max):
-                try:
-                    plot_from_pd(title, df, parameter, graph_obj, time_min, time_max)
-                except:
-                    logging.exception("Failed to generate plot for {}, dataset = {}".format(parameter, dataset_id))
-                    traceback.print_exc()
-            else:
-                logging.info(f"Datetime extents of previous graph for {filename} unchanged, skipping.")
-
-def check_time_min_max(dataset_name: str) -> Tuple[str, str]:
+            manifest['plots'][parameter] = {'key': filename,
+                                            'fingerprint': fingerprint}
+    save_manifest(s3, S3_BUCKET, dataset_id, manifest)
+
+
+def data_time_extents(df):
     '''
-    :param str erddap_dataset: ERDDAP endpoint
-    :return str: Minimum temporal extent ISO 8601 date string or empty string if not detected
-    :return str: Maximum temporal extent ISO 8601 date string or empty string if not detected
+    Returns the first and last time strings of a deployment's observations,
+    or None, None if it has none
+    :param pandas.DataFrame df: Observations with a time column
+    '''
+    times = df[[name for name in df.keys() if 'time' in name][0]].dropna()
+    if times.empty:
+        return None, None
+    return str(times.min()), str(times.max())
+
+
+def data_fingerprint(df, checksum=None):
+    '''
+    Returns a dict identifying the content of a deployment's observations: the
+    row count, time extents and a SHA-256 of the column names and values,
+    along with the upstream DAC checksum of the deployment
+    :param pandas.DataFrame df: Observations of a deployment
+    :param str checksum: DAC checksum of the deployment's files
+    '''
+    time_min, time_max = data_time_extents(df)
+    digest = hashlib.sha256(','.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return {
+        'rows': len(df),
+        'min_time': time_min,
+        'max_time': time_max,
+        'sha256': digest.hexdigest(),
+        'checksum': checksum,
+    }
+
+
+def load_manifest(s3, bucket_name, dataset_id):
+    '''
+    Returns the plot manifest of a deployment, or an empty one if there is
+    none or it can't be read
+    :param s3: boto3 S3 resource
+    :param str bucket_name: Bucket of the plots
+    :param str dataset_id: the deployment name
     '''
+    key = '{}/{}'.format(dataset_id, MANIFEST_NAME)
     try:
-        time_min, time_max = pd.read_csv(f"https://gliders.ioos.us/erddap/tabledap/{dataset_name}.csv?time&orderByMinMax(%22time%22)", skiprows=[1]).squeeze()
-        return time_min, time_max
-    except urllib.error.HTTPError:
-        logging.exception(f"HTTP exception attempting to detect min/max of dataset {dataset_name}, skipping.")
-        return "", ""
-    except:
-        logging.exception(f"Other error occurred attempting to detect min/max of dataset {dataset_name}, skipping.")
-        return "", ""
+        body = s3.Object(bucket_name, key).get()['Body'].read()
+        manifest = json.loads(body.decode('utf-8'))
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            logging.exception(f"Failed to read {key}")
+        return {'plots': {}}
+    except ValueError:
+        logging.exception(f"Invalid manifest {key}")
+        return {'plots': {}}
+    manifest.setdefault('plots', {})
+    return manifest
+
+
+def save_manifest(s3, bucket_name, dataset_id, manifest):
+    '''
+    Writes the plot manifest of a deployment
+    :param s3: boto3 S3 resource
+    :param str bucket_name: Bucket of the plots
+    :param str dataset_id: the deployment name
+    :param dict manifest: Rendered plots and the fingerprint of their data
+    '''
+    key = '{}/{}'.format(dataset_id, MANIFEST_NAME)
+    s3.Object(bucket_name, key).put(Body=json.dumps(manifest).encode('utf-8'),
+                                    ContentType='application/json')
 
-def get_erddap_data(dataset_id):
+
+def get_erddap_data(dataset_id, since=None):
     '''
     :param dataset_id: the deployment name example:'ce_311-20200708T1723'
-    :return: pandas DataFrame with deployment variable values
+    :param str since: Only fetch rows with a time after this ISO 8601 time
+    :return: pandas DataFrame with deployment variable values, empty if
+             there are no rows after since
     '''
     e = ERDDAP(
         server='https://gliders.ioos.us/erddap',
@@ -118,92 +229,355 @@ def get_erddap_data(dataset_id):
     )
     e.response = 'csv'
     e.dataset_id = dataset_id
-    e.variables = [
-        'depth',
-        'latitude',
-        'longitude',
-        'salinity',
-        'temperature',
-        'conductivity',
-        'density',
-        'time',
-    ]
+    e.variables = ERDDAP_VARIABLES
+    if since:
+        e.constraints = {'time>': since}
     try:
         df = e.to_pandas()
-    except HTTPError:
+    except Exception as err:
+        if since and 'no matching results' in str(err):
+            return pd.DataFrame()
+        if not isinstance(err, HTTPError):
+            raise
         logging.exception(f"Error fetching from {dataset_id}: ")
     else:
         return df
 
 
-def get_variables(dataset, parameter):
+class ObservationStore(object):
+    '''
+    Keeps the observations of each deployment as Parquet files so that only
+    the rows ERDDAP received since the last plot cycle are downloaded. Each
+    fetch is appended as a new part file, and the parts are merged once
+    there are more than max_parts of them. A state.json next to the parts
+    records when the deployment was last fetched in full and the DAC
+    checksum the observations correspond to.
+    '''
+
+    def __init__(self, directory, max_parts=16):
+        '''
+        :param str directory: Root directory of the store
+        :param int max_parts: Number of part files kept before merging them
+        '''
+        if pyarrow is None:
+            raise ImportError('The observation store requires pyarrow')
+        self.directory = directory
+        self.max_parts = max_parts
+
+    def _parts(self, dataset_id):
+        path = os.path.join(self.directory, dataset_id)
+        try:
+            names = sorted(n for n in os.listdir(path) if n.endswith('.parquet'))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(path, n) for n in names]
+
+    def load(self, dataset_id):
+        '''
+        Returns the stored observations of a deployment or None
+        :param str dataset_id: the deployment name
+        '''
+        parts = self._parts(dataset_id)
+        if not parts:
+            return None
+        return pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+
+    def state(self, dataset_id):
+        '''
+        Returns the state of a deployment's stored observations: 'created',
+        the time of the last full fetch, and the DAC 'checksum'
+        :param str dataset_id: the deployment name
+        '''
+        try:
+            with open(os.path.join(self.directory, dataset_id, 'state.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def append(self, dataset_id, df, checksum=None):
+        '''
+        Adds observations of a deployment to the store
+        :param str dataset_id: the deployment name
+        :param pandas.DataFrame df: Observations newer than the stored ones
+        :param str checksum: DAC checksum of the deployment, if known
+        '''
+        parts = self._parts(dataset_id)
+        path = os.path.join(self.directory, dataset_id)
+        os.makedirs(path, exist_ok=True)
+        number = int(os.path.basename(parts[-1]).split('.')[0]) + 1 if parts else 0
+        self._write(path, number, df)
+        if len(parts) + 1 > self.max_parts:
+            self._write(path, number + 1, self.load(dataset_id))
+            for part in parts + [os.path.join(path, '{:08d}.parquet'.format(number))]:
+                os.remove(part)
+        state = self.state(dataset_id)
+        state['checksum'] = checksum
+        self._write_state(path, state)
+
+    def replace(self, dataset_id, df, checksum=None):
+        '''
+        Replaces all of the stored observations of a deployment
+        :param str dataset_id: the deployment name
+        :param pandas.DataFrame df: Every observation of the deployment
+        :param str checksum: DAC checksum of the deployment, if known
+        '''
+        parts = self._parts(dataset_id)
+        path = os.path.join(self.directory, dataset_id)
+        os.makedirs(path, exist_ok=True)
+        number = int(os.path.basename(parts[-1]).split('.')[0]) + 1 if parts else 0
+        self._write(path, number, df)
+        for part in parts:
+            os.remove(part)
+        self._write_state(path, {'created': time.time(), 'checksum': checksum})
+
+    def _write(self, path, number, df):
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+        os.close(fd)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(path, '{:08d}.parquet'.format(number)))
+
+    def _write_state(self, path, state):
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(path, 'state.json'))
+
+
+def get_observation_store():
+    '''
+    Returns the configured ObservationStore or None
+    '''
+    if not OBSERVATION_STORE_DIR:
+        return None
+    if pyarrow is None:
+        logging.warning("OBSERVATION_STORE_DIR is set but pyarrow isn't installed")
+        return None
+    return ObservationStore(OBSERVATION_STORE_DIR)
+
+
+def get_row_count(dataset_id):
+    '''
+    Returns the number of observations with a time ERDDAP has for a
+    deployment, or None if it can't be determined
+    :param str dataset_id: the deployment name
+    '''
+    url = f"https://gliders.ioos.us/erddap/tabledap/{dataset_id}.csv?time&orderByCount(%22%22)"
+    try:
+        return int(pd.read_csv(url, skiprows=[1]).squeeze())
+    except Exception:
+        logging.exception(f"Failed to count the observations of {dataset_id}")
+        return None
+
+
+def count_times(df):
+    '''
+    Returns the number of observations with a time in a DataFrame
+    '''
+    names = [name for name in df.keys() if 'time' in name]
+    return int(df[names[0]].notna().sum()) if names else 0
+
+
+def get_observations(dataset_id, time_extents=None, store=None, checksum=None):
+    '''
+    Returns the observations of a deployment. With an observation store only
+    the rows newer than the stored ones are fetched from ERDDAP.
+
+    The deployment is fetched in full instead when nothing is stored, when
+    the dataset's minimum time no longer matches the stored one, when the
+    stored observations are older than OBSERVATION_STORE_MAX_AGE or when
+    they don't add up to ERDDAP's row count. The row count is only requested
+    when the maximum time moved or the DAC checksum changed. A new checksum
+    is only recorded along with new rows, as the DAC usually has new files
+    before ERDDAP has loaded them.
+    :param str dataset_id: the deployment name
+    :param tuple time_extents: Optional (min, max) ISO 8601 times of the
+                               dataset. No rows are fetched if the stored
+                               observations already reach max.
+    :param ObservationStore store: Defaults to get_observation_store()
+    :param str checksum: Optional DAC checksum of the deployment
+    :return: pandas DataFrame with deployment variable values or None
+    '''
+    store = store or get_observation_store()
+    if store is None:
+        return get_erddap_data(dataset_id)
+
+    time_min, time_max = time_extents or (None, None)
+    stored = store.load(dataset_id)
+    state = store.state(dataset_id)
+    if stored is not None:
+        stored_min, stored_max = data_time_extents(stored)
+        expired = time.time() - state.get('created', 0) > OBSERVATION_STORE_MAX_AGE
+        if stored_max is None or (time_min and stored_min != time_min) or expired:
+            stored = None
+
+    if stored is not None:
+        new = pd.DataFrame()
+        max_moved = not (time_max and stored_max == time_max)
+        if max_moved:
+            new = get_erddap_data(dataset_id, since=stored_max)
+            if new is None:
+                logging.warning(f"Using the stored observations of {dataset_id}")
+                return stored
+        checksum_changed = checksum is not None and checksum != state.get('checksum')
+        if not (max_moved or checksum_changed):
+            return stored
+        rows = get_row_count(dataset_id)
+        if rows is not None and count_times(stored) + count_times(new) != rows:
+            logging.info(f"Stored observations of {dataset_id} are out of date, fetching them again")
+        elif new.empty:
+            return stored
+        else:
+            store.append(dataset_id, new, checksum)
+            return pd.concat([stored, new], ignore_index=True)
+
+    df = get_erddap_data(dataset_id)
+    if df is not None and not df.empty:
+        store.replace(dataset_id, df, checksum)
+    return df
+
+
+class ProfileFrame(object):
+    '''
+    The time and depth axes of a deployment's observations, parsed once with
+    vectorized operations and shared by every parameter
+    '''
+
+    def __init__(self, dataset):
+        '''
+        :param dataset: pandas DataFrame with deployment data
+        '''
+        if 'Error' in dataset.keys()[0]:
+            print(dataset[dataset.keys()[0]][1])
+            exit()
+
+        # get the names of the columns from the dataset
+        self.dataset = dataset
+        self.y_name = [name for name in dataset.keys() if 'depth' in name][0]
+        self.x_name = [name for name in dataset.keys() if 'time' in name][0]
+
+        # parse the '%Y-%m-%dT%H:%M:%SZ' timestamps in one pass, missing and
+        # malformed ones become NaT and their rows are dropped
+        times = pd.to_datetime(dataset[self.x_name], utc=True, errors='coerce')
+        times = times.dt.tz_convert(None).to_numpy('datetime64[s]')
+        self.valid = ~np.isnat(times)
+
+        # mask invalid values
+        self.x = ma.masked_invalid(times[self.valid])
+        self.y = ma.masked_invalid(self.column(self.y_name))
+
+    def column(self, name):
+        '''
+        Returns the float values of a column at the valid timestamps
+        '''
+        return pd.to_numeric(self.dataset[name], errors='coerce').to_numpy(
+            dtype=float, na_value=np.nan)[self.valid]
+
+    def variables(self, parameter):
+        '''
+        Returns the same tuple as get_variables for a parameter
+        '''
+        z_name = [name for name in self.dataset.keys() if parameter in name][0]
+        z = ma.masked_invalid(self.column(z_name))
+        return self.x, self.y, z, self.x_name, self.y_name, z_name
+
+
+def get_variables(dataset, parameter, frame=None):
     '''
     :param dataset: pandas DataFrame with deployment data
     :param parameter: name of parameter to plot
-    :return x: list of datetime object, time
+    :param ProfileFrame frame: The parsed dataset, shared between parameters
+    :return x: numpy.ndarray datetime64, time
             y, z: numpy.ndarray depth, values
             x_name y_name z_name: string parameter name
     '''
-    if 'Error' in dataset.keys()[0]:
-        print(dataset[dataset.keys()[0]][1])
-        exit()
-
-    # get the names of the columns from the dataset
-    y_name = [name for name in dataset.keys() if 'depth' in name]
-    x_name = [name for name in dataset.keys() if 'time' in name]
-    z_name = [name for name in dataset.keys() if parameter in name]
-
-    # get the data arrays
-    y = dataset[y_name[0]].values
-    z = dataset[z_name[0]].values
-    x = dataset[x_name[0]].values
-
-    # create list of datetime object from the numpy.ndarray of
-    # date/time string values in the format '%Y-%m-%dT%H:%M:%SZ'
-    # get the indices of non-nan timestamps
-    xv = list()
-    ii = list()
-    for i, d in enumerate(x):
-        try:
-            xv.append(datetime.strptime(d, '%Y-%m-%dT%H:%M:%SZ'))
-            ii.append(i)
-        except TypeError:
-            error = 'strptime() argument 1 must be str, not float'
-    #         print(error)
-
-    # select only non-nan values
-    yv = [y[n] for n in ii]
-    xv = [x[n] for n in ii]
-    zv = [z[n] for n in ii]
-
-    # convert arrays to datatime or float to mask invalid values in the next step
-    xv = np.array(xv, dtype='datetime64')
-    yv = np.array(yv, dtype='float')
-    zv = np.array(zv, dtype='float')
+    if frame is None:
+        frame = ProfileFrame(dataset)
+    return frame.variables(parameter)
 
-    # mask invalid values
-    xv = ma.masked_invalid(xv)
-    yv = ma.masked_invalid(yv)
-    zv = ma.masked_invalid(zv)
 
-    return xv, yv, zv, x_name[0], y_name[0], z_name[0]
+def box_sum(a, radius):
+    '''
+    Returns the sum of each element's (2 * radius + 1) square neighbourhood
+    '''
+    width = 2 * radius + 1
+    a = np.pad(a, radius + 1)[:-1, :-1]
+    a = a.cumsum(axis=0).cumsum(axis=1)
+    return (a[width:, width:] - a[:-width, width:] -
+            a[width:, :-width] + a[:-width, :-width])
 
 
-def get_plot(x, y, z, cmap='cmap', title='Glider Profiles', ylabel='Pressure (dbar)', zlabel='Temperature'):
+def bin_observations(x, y, z, bins=RASTER_BINS, fill=RASTER_FILL):
+    '''
+    Averages observations onto a regular time-depth grid
+    :param x: numpy.ndarray datetime64 times
+    :param y: numpy.ndarray depths
+    :param z: numpy.ndarray values
+    :param tuple bins: Number of time and depth bins
+    :param int fill: Radius in bins over which empty bins are filled from
+                     their neighbours, like the footprint of a marker
+    :return time_edges: numpy.ndarray datetime64 bin edges
+            depth_edges: numpy.ndarray bin edges
+            grid: masked (depth, time) array of mean values, masked where
+                  a bin is empty, or None if no observation is complete
+    '''
+    t = ma.getdata(x).astype('datetime64[s]')
+    d = ma.getdata(y).astype(float)
+    v = ma.getdata(z).astype(float)
+    valid = (~np.isnat(t) & np.isfinite(d) & np.isfinite(v) &
+             ~ma.getmaskarray(x) & ~ma.getmaskarray(y) & ~ma.getmaskarray(z))
+    if not valid.any():
+        return None, None, None
+    t = t[valid].astype(np.int64)
+    d = d[valid]
+    v = v[valid]
+
+    n_time, n_depth = bins
+    t0, t1 = t.min(), t.max()
+    d0, d1 = d.min(), d.max()
+    t1 = max(t1, t0 + 1)
+    d1 = max(d1, d0 + 1)
+    ti = np.minimum((t - t0) * n_time // (t1 - t0), n_time - 1)
+    di = np.minimum(((d - d0) * (n_depth / (d1 - d0))).astype(np.int64), n_depth - 1)
+
+    flat = di * n_time + ti
+    sums = np.bincount(flat, weights=v, minlength=n_time * n_depth)
+    counts = np.bincount(flat, minlength=n_time * n_depth)
+    sums = sums.reshape(n_depth, n_time)
+    counts = counts.reshape(n_depth, n_time)
+    if fill:
+        empty = counts == 0
+        sums = np.where(empty, box_sum(sums, fill), sums)
+        counts = np.where(empty, box_sum(counts, fill), counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = ma.masked_invalid(sums / counts)
+
+    time_edges = np.linspace(t0, t1, n_time + 1).round().astype(np.int64)
+    return (time_edges.astype('datetime64[s]'),
+            np.linspace(d0, d1, n_depth + 1), grid)
+
+
+def get_plot(x, y, z, cmap='cmap', title='Glider Profiles', ylabel='Pressure (dbar)', zlabel='Temperature',
+             mode='auto'):
     '''
     Renders a matplotlib profile plot
-    :param x: list datetime object
+    :param x: numpy.ndarray datetime64 times
     :param y: numpy.ndarray  depths
     :param z: numpy.ndarray  values
     :param cmap: The colormap to use on the plot
     :param str title: Title of the plot
     :param str ylabel: The label to display along the Y-Axis
     :param str zlabel: The label to display along the color bar legend
+    :param str mode: 'scatter' draws every observation, 'raster' the mean of
+                     the observations binned onto a time-depth grid and
+                     'auto' rasters at RASTER_MIN_POINTS observations or more
     :return fig: figure handle
     '''
 
-    # print(title)
-    fig, ax = plt.subplots()
+    # A Figure of its own rather than pyplot's global state, so plots can be
+    # rendered concurrently
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
     ax.set_title(title)
 
     # check z for all nan values
@@ -224,11 +598,18 @@ def get_plot(x, y, z, cmap='cmap', title='Glider Profiles', ylabel='Pressure (db
         if vmin < 0:
             vmin = 0
 
-        im = ax.scatter(x, y, c=z, cmap=cmap, vmin=vmin, vmax=vmax)
+        grid = None
+        if mode == 'raster' or (mode == 'auto' and len(z) >= RASTER_MIN_POINTS):
+            time_edges, depth_edges, grid = bin_observations(x, y, z)
+        if grid is not None:
+            im = ax.pcolormesh(time_edges, depth_edges, grid, cmap=cmap,
+                               vmin=vmin, vmax=vmax, shading='flat')
+        else:
+            im = ax.scatter(x, y, c=z, cmap=cmap, vmin=vmin, vmax=vmax)
         colorbar = fig.colorbar(im, ax=ax)
         colorbar.set_label(zlabel)
 
-    ax.set_xlim(min(x), max(x))
+    ax.set_xlim(x.min(), x.max())
     ax.invert_yaxis()
     date_format = mdates.DateFormatter('%Y-%m-%d')
     ax.xaxis.set_major_formatter(date_format)
@@ -238,31 +619,91 @@ def get_plot(x, y, z, cmap='cmap', title='Glider Profiles', ylabel='Pressure (db
     return fig
 
 
-def plot_from_pd(title, dataset, parameter, plot_obj,
-                 plot_min_time_str, plot_max_time_str):
+def render_plot(title, frame, parameter, mode='auto'):
     '''
-    Plot the parameter from an ERDDAP .csv file put into a pandas DataFrame.
+    Renders the plot of one parameter and returns the PNG bytes
     :param str title: Title of the plot
-    :param pandas.DataFrame dataset: A DataFrame containing values to plot
+    :param ProfileFrame frame: The parsed dataset
     :param str parameter: Parameter name to plot
-    :param boto3.S3.Object: The S3 object used for storing the plot
-    :param str min_time_str: The minimum time string represented as an ISO8601 datetime
-    :param str max_time_str: The maximum time string represented as an ISO8601 datetime
+    :param str mode: Rendering mode of get_plot
     '''
-    x, y, z, xlabel, ylabel, zlabel = get_variables(dataset, parameter)
-
-    c = [PARAMETERS[key]['cmap'] for key in PARAMETERS.keys()
-         if key == parameter]
+    x, y, z, xlabel, ylabel, zlabel = frame.variables(parameter)
 
-    fig = get_plot(x, y, z, c[0], title, ylabel, zlabel)
+    fig = get_plot(x, y, z, PARAMETERS[parameter]['cmap'], title, ylabel, zlabel,
+                   mode)
 
     fig.set_size_inches(20, 5)
 
     with io.BytesIO() as img_data:
-        plt.savefig(img_data, format='png')
-        img_data.seek(0)
-        plot_obj.put(Body=img_data, ContentType='image/png',
-                    Metadata={"min_time": plot_min_time_str,
-                              "max_time": plot_max_time_str})
+        fig.savefig(img_data, format='png')
+        return img_data.getvalue()
+
+
+# The frame being rendered, inherited by forked render processes rather than
+# pickled to them
+_render_frame = None
 
-        plt.close(fig)
+
+def _render_shared(title, parameter):
+    return render_plot(title, _render_frame, parameter)
+
+
+def render_plots(dataset_id, frame, parameters):
+    '''
+    Renders the plots of several parameters of a deployment concurrently
+    and returns a dictionary of parameter to PNG bytes, or to the exception
+    raised while rendering it.
+
+    Parameters are rendered in forked processes when PLOT_EXECUTOR is
+    'process' and forking is possible, otherwise one after another, e.g. in
+    daemonic processes which can't have children.
+    :param str dataset_id: The deployment name
+    :param ProfileFrame frame: The parsed dataset
+    :param list parameters: Parameter names to plot
+    '''
+    global _render_frame
+    titles = {parameter: f"{dataset_id} {parameter.title()} Profiles"
+              for parameter in parameters}
+    workers = max(min(PLOT_WORKERS, len(parameters)), 1)
+    use_processes = (PLOT_EXECUTOR == 'process' and workers > 1 and
+                     'fork' in multiprocessing.get_all_start_methods() and
+                     not multiprocessing.current_process().daemon)
+
+    images = {}
+    if use_processes:
+        # The frame is inherited by the forked children rather than pickled.
+        # multiprocessing.Pool is used as ProcessPoolExecutor only accepts a
+        # start method from Python 3.7.
+        _render_frame = frame
+        try:
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                results = {parameter: pool.apply_async(_render_shared, (titles[parameter], parameter))
+                           for parameter in parameters}
+                for parameter, result in results.items():
+                    try:
+                        images[parameter] = result.get()
+                    except Exception as e:
+                        images[parameter] = e
+        finally:
+            _render_frame = None
+        return images
+
+    for parameter in parameters:
+        try:
+            images[parameter] = render_plot(titles[parameter], frame, parameter)
+        except Exception as e:
+            images[parameter] = e
+    return images
+
+
+def put_plot(plot_obj, png, plot_min_time_str, plot_max_time_str):
+    '''
+    Uploads a rendered plot to S3
+    :param boto3.S3.Object: The S3 object used for storing the plot
+    :param bytes png: The PNG image
+    :param str min_time_str: The minimum time string represented as an ISO8601 datetime
+    :param str max_time_str: The maximum time string represented as an ISO8601 datetime
+    '''
+    plot_obj.put(Body=png, ContentType='image/png',
+                 Metadata={"min_time": plot_min_time_str,
+                           "max_time": plot_max_time_str})
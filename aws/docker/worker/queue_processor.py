@@ -32,7 +32,7 @@ def main(SQS_URL):
                     obj = json.loads(body)     # load as object
                     erddap_dataset = obj['erddap_dataset']
                     logging.info("Plotting from {}".format(erddap_dataset))
-                    generate_profile_plot(erddap_dataset)
+                    generate_profile_plot(erddap_dataset, checksum=obj.get('checksum'))
                 except Exception:
                     logging.exception("processing error")
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+'''
+benchmarks/import_time.py
+
+Measures the startup cost of the application in fresh interpreters:
+
+- import app: what every gunicorn and Celery worker pays now that the land
+  polygons are loaded lazily
+- import app + shapefile: the previous behaviour, where the 10m Natural Earth
+  shapefile was parsed while importing status.trajectories
+- import app + WKB cache: the first land mask lookup once the binary cache
+  exists
+
+    python benchmarks/import_time.py --repeat 5
+'''
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SCENARIOS = (
+    ('import app', ''),
+    ('import app + shapefile',
+     'from status.land_mask import load_land_geometries\n'
+     'load_land_geometries()\n'),
+    ('import app + WKB cache',
+     'from status.land_mask import load_land_geometries\n'
+     'load_land_geometries({cache_dir!r})\n'),
+)
+
+TEMPLATE = '''
+import time
+start = time.perf_counter()
+import app
+{extra}
+print(time.perf_counter() - start)
+'''
+
+
+def run(code):
+    '''
+    Returns the seconds reported by code run in a new interpreter
+    '''
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT,
+                                     stderr=subprocess.DEVNULL)
+    return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(repeat):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # Build the WKB cache before timing reads from it
+        run(TEMPLATE.format(extra=SCENARIOS[2][1].format(cache_dir=cache_dir)))
+        for name, extra in SCENARIOS:
+            code = TEMPLATE.format(extra=extra.format(cache_dir=cache_dir))
+            times = [run(code) for _ in range(repeat)]
+            print('{:28s} median {:7.3f} s  min {:7.3f} s'.format(
+                name, statistics.median(times), min(times)))
+    finally:
+        shutil.rmtree(cache_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of interpreters started per scenario')
+    args = parser.parse_args()
+    sys.exit(main(args.repeat))
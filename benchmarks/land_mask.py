@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+benchmarks/land_mask.py
+
+Compares the STRtree land mask with the original loop over every land polygon
+on a synthetic glider track. The loop is only run on a sample of the track and
+its time is extrapolated to the full track.
+
+    python benchmarks/land_mask.py --points 50000 --loop-points 500
+'''
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import shapely.geometry as sgeom
+from app import app  # noqa: F401 sets up the status package
+from status.land_mask import LandMask, load_land_geometries
+
+land_geom = load_land_geometries()
+
+
+def synthetic_track(n_points, seed=0):
+    '''
+    Returns lon, lat arrays of a random walk along the US East Coast shelf
+    '''
+    rng = np.random.default_rng(seed)
+    lon = -74.0 + np.cumsum(rng.normal(0, 0.01, n_points))
+    lat = 38.0 + np.cumsum(rng.normal(0, 0.01, n_points))
+    return lon, lat
+
+
+def loop_is_on_land(lon, lat):
+    '''
+    The original per-point test against every land polygon
+    '''
+    point = sgeom.Point(lon, lat)
+    return any(poly.contains(point) for poly in land_geom)
+
+
+def main(n_points, loop_points):
+    lon, lat = synthetic_track(n_points)
+    print('{} land polygons, {} track points'.format(len(land_geom), n_points))
+
+    start = time.perf_counter()
+    land_mask = LandMask(land_geom)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    on_land = land_mask.contains(lon, lat)
+    vectorized = time.perf_counter() - start
+
+    sample = np.linspace(0, n_points - 1, min(loop_points, n_points)).astype(int)
+    start = time.perf_counter()
+    expected = np.array([loop_is_on_land(lon[i], lat[i]) for i in sample])
+    loop = (time.perf_counter() - start) * n_points / len(sample)
+
+    assert (on_land[sample] == expected).all(), 'land masks disagree'
+    print('STRtree build:        {:10.3f} s'.format(build))
+    print('STRtree contains:     {:10.3f} s'.format(vectorized))
+    print('Polygon loop (est.):  {:10.3f} s'.format(loop))
+    print('Speedup:              {:10.1f}x'.format(loop / vectorized))
+    return 0
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=50000,
+                        help='Number of track points')
+    parser.add_argument('--loop-points', type=int, default=500,
+                        help='Number of points timed with the original loop')
+    args = parser.parse_args()
+    sys.exit(main(args.points, args.loop_points))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''
+benchmarks/profile_plot_render.py
+
+Compares the render time and peak memory of the scatter and binned raster
+profile plots on synthetic glider deployments. Every render runs in a fresh
+interpreter so the peak resident set size belongs to that render alone.
+Scatter renders above --scatter-max points are skipped.
+
+    python benchmarks/profile_plot_render.py --points 10000 1000000 10000000
+'''
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+RENDER = '''
+import io
+import resource
+import time
+import numpy as np
+import numpy.ma as ma
+from aws.docker.worker.generate_profile_plot import PARAMETERS, get_plot
+
+n = {points}
+# A sawtooth of 0-200 m dives every 30 minutes, one observation every 2 s
+t = np.datetime64('2020-01-01T00:00:00') + np.arange(n).astype('timedelta64[s]') * 2
+phase = (np.arange(n) % 900) / 450.0
+depth = 200 * np.minimum(phase, 2 - phase)
+rng = np.random.default_rng(0)
+temperature = 25 - depth / 10 + rng.normal(0, 0.2, n)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+start = time.perf_counter()
+fig = get_plot(ma.masked_invalid(t), ma.masked_invalid(depth),
+               ma.masked_invalid(temperature), PARAMETERS['temperature']['cmap'],
+               mode='{mode}')
+fig.set_size_inches(20, 5)
+with io.BytesIO() as img_data:
+    fig.savefig(img_data, format='png')
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, (peak - before) / 1024.0, peak / 1024.0)
+'''
+
+
+def render(points, mode):
+    '''
+    Returns the seconds, peak MB added by the render and peak MB of the
+    process rendering a synthetic deployment
+    '''
+    code = RENDER.format(points=points, mode=mode)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return [float(v) for v in output.decode('utf-8').split()]
+
+
+def main(points, scatter_max):
+    print('{:>10s} {:>8s} {:>10s} {:>14s} {:>12s}'.format(
+        'points', 'mode', 'seconds', 'render MB', 'peak MB'))
+    for n in points:
+        for mode in ('scatter', 'raster'):
+            if mode == 'scatter' and n > scatter_max:
+                print('{:>10d} {:>8s} {:>10s}'.format(n, mode, 'skipped'))
+                continue
+            seconds, added, peak = render(n, mode)
+            print('{:>10d} {:>8s} {:>10.2f} {:>14.1f} {:>12.1f}'.format(
+                n, mode, seconds, added, peak))
+    return 0
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+',
+                        default=[10000, 1000000, 10000000],
+                        help='Sizes of the synthetic deployments')
+    parser.add_argument('--scatter-max', type=int, default=1000000,
+                        help='Largest deployment rendered with scatter')
+    args = parser.parse_args()
+    sys.exit(main(args.points, args.scatter_max))
@@ -15,6 +15,21 @@ def get_trajectory_features():
     from status.tasks import get_trajectory_features
     result = get_trajectory_features.delay()
 
+@manager.command
+def watch():
+    '''
+    Refreshes deployments as soon as new files land in FILE_DIR
+    '''
+    from status.tasks import refresh_deployment
+    from status.watcher import DeploymentWatcher
+    config = app.config.get('WATCHER') or {}
+    watcher = DeploymentWatcher(app.config['FILE_DIR'],
+                                refresh_deployment.delay,
+                                debounce=config.get('DEBOUNCE', 30),
+                                poll_interval=config.get('POLL_INTERVAL', 10),
+                                mode=config.get('MODE', 'auto'))
+    watcher.run()
+
 @manager.command
 def list_routes():
     import urllib.request, urllib.parse, urllib.error
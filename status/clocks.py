@@ -7,6 +7,7 @@ Helper methods to deal with clock conversions
 
 import time
 import calendar
+import numpy as np
 
 def epoch2ts(epoch):
     
@@ -23,3 +24,17 @@ def erddap_epoch2ts(epoch):
 def erddap_ts2epoch(ts):
     
     return calendar.timegm(time.strptime(ts, '%Y-%m-%dT%H:%M:%SZ'))
+
+def erddap_ts2datetime64(timestamps):
+    '''
+    Converts a sequence of ERDDAP timestamps, e.g. '2020-01-01T00:00:00Z', to
+    a datetime64[s] array in a single pass. Missing timestamps become NaT.
+    datetime64 arrays are returned as they are.
+    '''
+    if getattr(timestamps, 'dtype', None) is not None and timestamps.dtype.kind == 'M':
+        return timestamps.astype('datetime64[s]').ravel()
+    timestamps = np.array(timestamps, dtype=object).ravel()
+    timestamps[timestamps == None] = 'NaT'  # noqa: E711 elementwise
+    # Truncating to 19 characters drops the trailing Z, which numpy would
+    # otherwise warn about
+    return timestamps.astype('U19').astype('datetime64[s]')
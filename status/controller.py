@@ -6,13 +6,19 @@ The controller definition for the status application. This mostly contains the
 routes and logic API
 '''
 
-import requests
 from flask import jsonify, current_app
 from status import api
-from status.trajectories import get_trajectory
+from status import http_client
+from status.single_flight import SingleFlight
+from status.trajectories import (FORMATS, build_trajectory, get_formats,
+                                 get_relative_path, select_tolerance)
 from status.glider_days import glider_days
-from flask import jsonify, request, current_app, make_response
-import requests
+from flask import jsonify, request, current_app, make_response, send_from_directory
+from werkzeug.security import safe_join
+import os
+
+# Concurrent requests for a missing trajectory share one build
+_trajectory_builds = SingleFlight()
 @api.route('/test')
 def test():
     return jsonify(message="Running")
@@ -24,7 +30,7 @@ def test():
 @api.route('/deployment', methods=['GET'])
 def get_deployments():
     url = current_app.config.get('DAC_API')
-    response = requests.get(url)
+    response = http_client.get(url)
     return response.content, response.status_code, dict(response.headers)
 
 
@@ -32,21 +38,56 @@ def get_deployments():
 def get_deployment(username, deployment_name):
     url = current_app.config.get('DAC_API')
     url += '/%s/%s' % (username, deployment_name)
-    response = requests.get(url)
+    response = http_client.get(url)
     return response.content, response.status_code, dict(response.headers)
 
 
 @api.route('/track/<string:username>/<string:deployment_name>')
 def track(username, deployment_name):
+    '''
+    Returns the trajectory of a deployment. The level of detail is chosen by
+    the optional zoom (web map zoom level) or tolerance (degrees) parameters.
+    The format parameter selects 'geojson' (default), 'polyline' or the
+    'binary' container, see status.track_encoding.
+
+    The file written by the trajectory task is served. It's only built here
+    if it doesn't exist yet.
+    '''
+    try:
+        tolerance = select_tolerance(request.args.get('zoom', type=float),
+                                     request.args.get('tolerance', type=float))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    fmt = request.args.get('format', 'geojson')
+    if fmt not in get_formats():
+        return jsonify(error="Unsupported format: {}".format(fmt)), 400
+    trajectory_dir = os.path.abspath(current_app.config.get('TRAJECTORY_DIR'))
+    relative_path = get_relative_path(username, deployment_name, tolerance, fmt)
+    file_path = safe_join(trajectory_dir, relative_path)
+    if file_path is None:
+        return jsonify(error="Invalid deployment"), 404
+    if not os.path.exists(file_path):
+        built = _trajectory_builds.do((username, deployment_name),
+                                      _build_trajectory, username,
+                                      deployment_name)
+        if not built:
+            return jsonify(error="Unable to read from DAC API"), 500
+    return send_from_directory(trajectory_dir, relative_path,
+                               mimetype=FORMATS[fmt][1])
+
+
+def _build_trajectory(username, deployment_name):
+    '''
+    Looks up a deployment in the DAC API and writes its trajectory files.
+    Returns False if the DAC API request fails.
+    '''
     url = current_app.config.get('DAC_API')
     url += '/%s/%s' % (username, deployment_name)
-    response = requests.get(url)
+    response = http_client.get(url)
     if response.status_code != 200:
-        return jsonify(error="Unable to read from DAC API"), 500
-    deployment = response.json()
-    erddap_url = deployment['erddap']
-    geo_data = get_trajectory(erddap_url)
-    return jsonify(**geo_data)
+        return False
+    build_trajectory(response.json())
+    return True
 
 @api.route('/gliderdac/days')
 def get_glider_days():
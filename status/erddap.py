@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''
+status.erddap
+
+Helper methods for querying the GliderDAC ERDDAP server
+'''
+
+from status import http_client
+import io
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Rows parsed at a time by read_csv_columns
+CSV_CHUNK_ROWS = 100000
+
+
+class ErddapCatalog(object):
+    '''
+    A snapshot of the ERDDAP allDatasets table indexed by datasetID so that
+    rows and columns can be looked up in constant time
+    '''
+
+    def __init__(self, table):
+        '''
+        :param dict table: The 'table' object of an allDatasets.json response
+        '''
+        self.column_names = table['columnNames']
+        self.column_index = {
+            name: i for i, name in enumerate(self.column_names)}
+        id_index = self.column_index['datasetID']
+        self.rows = {}
+        for row in table['rows']:
+            # Keep the first row if a datasetID is listed more than once
+            self.rows.setdefault(row[id_index], row)
+
+    @classmethod
+    def fetch(cls, url, get=http_client.get):
+        '''
+        Returns a catalog built from an allDatasets.json URL, or None if the
+        request fails
+
+        :param str url: URL of the ERDDAP allDatasets.json table
+        :param get: Callable used to make the HTTP request
+        '''
+        logger.info('Fetching ERDDAP datasets: %s', url)
+        r = get(url, timeout=60)
+        if r.status_code != 200:
+            logger.error('ERDDAP request failed: %s (%s)', url, r.reason)
+            return None
+        try:
+            return cls(r.json()['table'])
+        except (ValueError, KeyError):
+            logger.exception('Failed to convert ERDDAP response from JSON')
+            return None
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, dataset_id, column, default=None):
+        '''
+        Returns a single value from the catalog
+
+        :param str dataset_id: ERDDAP datasetID
+        :param str column: allDatasets column name
+        :param default: Value returned if the dataset or column doesn't exist
+        '''
+        row = self.rows.get(dataset_id)
+        if row is None or column not in self.column_index:
+            return default
+        return row[self.column_index[column]]
+
+    def record(self, dataset_id, columns=None):
+        '''
+        Returns a dictionary of column name to value for a dataset, or None if
+        the dataset isn't in the catalog
+
+        :param str dataset_id: ERDDAP datasetID
+        :param list columns: Columns to include, defaults to all of them
+        '''
+        row = self.rows.get(dataset_id)
+        if row is None:
+            return None
+        columns = columns or self.column_names
+        return {column: row[self.column_index[column]] for column in columns}
+
+
+def get_profile_summary(tabledap_url, get=http_client.get):
+    '''
+    Returns a tuple of the WMO ID and the number of profiles in a dataset, or
+    None if the dataset couldn't be read.
+
+    ERDDAP is asked to reduce the table to the row with the largest
+    profile_id so only a single row comes back. If the server rejects the
+    aggregated query the whole wmo_id,profile_id table is pulled instead.
+
+    :param str tabledap_url: The dataset's tabledap URL without an extension
+    :param get: Callable used to make the HTTP requests
+    '''
+    json_url = tabledap_url + '.json'
+    data_url = json_url + '?wmo_id,profile_id&orderByMax(%22profile_id%22)'
+    logger.info('Fetching data url: %s', data_url)
+    r = get(data_url, timeout=120)
+    if r.status_code == 200:
+        rows = r.json()['table']['rows']
+        wmo_id = rows[0][0] if rows and rows[0][0] else None
+        num_profiles = rows[0][1] if rows and rows[0][1] else 0
+        # The row with the last profile may not carry the WMO ID
+        if wmo_id is None:
+            wmo_id = get_first_wmo_id(tabledap_url, get)
+        return wmo_id, num_profiles
+
+    logger.warning('Aggregated query failed, pulling all profiles: %s (%s)',
+                   data_url, r.reason)
+    data_url = tabledap_url + '.csv?wmo_id,profile_id'
+    logger.info('Fetching data url: %s', data_url)
+    r = get(data_url, timeout=120, stream=True)
+    if r.status_code != 200:
+        logger.error('Dataset fetch error: %s', r.reason)
+        return None
+
+    columns = read_csv_columns(r, {'wmo_id': str, 'profile_id': float})
+    wmo_ids = columns['wmo_id']
+    wmo_ids = wmo_ids[pd.notna(wmo_ids) & (wmo_ids != '')]
+    wmo_id = wmo_ids[0] if len(wmo_ids) else None
+
+    profiles = columns['profile_id']
+    profiles = profiles[np.isfinite(profiles)]
+    num_profiles = int(profiles.max()) if len(profiles) and profiles.max() > 0 else 0
+    return wmo_id, num_profiles
+
+
+def get_first_wmo_id(tabledap_url, get=http_client.get):
+    '''
+    Returns the first non-empty distinct WMO ID of a dataset or None
+
+    :param str tabledap_url: The dataset's tabledap URL without an extension
+    :param get: Callable used to make the HTTP requests
+    '''
+    data_url = tabledap_url + '.json?wmo_id&distinct()'
+    logger.info('Fetching data url: %s', data_url)
+    r = get(data_url, timeout=120)
+    if r.status_code != 200:
+        return None
+    wmo_ids = [row[0] for row in r.json()['table']['rows'] if row[0]]
+    return wmo_ids[0] if wmo_ids else None
+
+
+def read_csv_columns(response, dtypes, chunk_rows=CSV_CHUNK_ROWS):
+    '''
+    Parses an ERDDAP .csv response into a dictionary of column name to NumPy
+    array without holding the body or per-row Python lists in memory. The
+    body is read in chunks of rows and each chunk's columns are kept as typed
+    arrays.
+
+    The request should be made with stream=True. Responses that were already
+    read, such as cached ones, are parsed from their content.
+
+    :param requests.Response response: Response of a tabledap .csv request
+    :param dict dtypes: Column name to dtype. 'datetime64[s]' parses ERDDAP
+                        ISO 8601 times, missing values become NaT.
+    :param int chunk_rows: Number of rows parsed at a time
+    '''
+    times = [name for name, dtype in dtypes.items() if dtype == 'datetime64[s]']
+    if response.raw is not None:
+        response.raw.decode_content = True
+        body = response.raw
+    else:
+        body = io.BytesIO(response.content)
+
+    chunks = {name: [] for name in dtypes}
+    # The second line of an ERDDAP csv holds the units
+    reader = pd.read_csv(body, skiprows=[1], chunksize=chunk_rows,
+                         usecols=list(dtypes),
+                         dtype={name: dtype for name, dtype in dtypes.items()
+                                if name not in times})
+    with reader:
+        for chunk in reader:
+            for name in dtypes:
+                if name in times:
+                    values = pd.to_datetime(chunk[name], utc=True, errors='coerce')
+                    values = values.dt.tz_convert(None).to_numpy('datetime64[s]')
+                else:
+                    values = chunk[name].to_numpy()
+                chunks[name].append(values)
+
+    columns = {}
+    for name, dtype in dtypes.items():
+        if chunks[name]:
+            columns[name] = np.concatenate(chunks[name])
+        else:
+            columns[name] = np.empty(0, dtype=object if dtype is str else dtype)
+    return columns
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+'''
+status.fetch_pool
+
+A bounded thread pool for running the per-deployment HTTP lookups in parallel
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from status import http_client
+import threading
+
+
+class FetchPool(object):
+    '''
+    Runs a function over a sequence of items on a bounded thread pool. Results
+    are returned in the same order as the input so that the output of a
+    parallel sweep is identical to a serial one.
+
+    Requests made through :meth:`get` go through the shared HTTP client, which
+    caps the concurrent requests per host, and are counted.
+    '''
+
+    def __init__(self, max_workers=8):
+        '''
+        :param int max_workers: Number of worker threads
+        '''
+        self.max_workers = max_workers
+        self.fetch_count = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        '''
+        Issues a GET request with the shared HTTP client
+
+        :param str url: URL to request
+        '''
+        with self._lock:
+            self.fetch_count += 1
+        return http_client.get(url, **kwargs)
+
+    def map(self, func, items):
+        '''
+        Returns a list of func applied to each item, in the order of items
+
+        :param func: Callable taking a single item
+        :param items: Iterable of items
+        '''
+        if self.max_workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
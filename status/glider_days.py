@@ -6,9 +6,12 @@ Helper methods for calculating the number of glider days in a deployment
 for each glider operator
 '''
 
-import requests
+import io
 import json
 import pandas as pd
+from app import app
+from status import http_client
+from status.erddap import ErddapCatalog
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
@@ -22,21 +25,26 @@ def glider_days(year):
     if year is not None:
         year = int(year)  # Convert string to int
     deployment_url = 'https://data.ioos.us/gliders/providers/api/deployment'
-    response = requests.get(deployment_url)
+    response = http_client.get(deployment_url)
     if response.status_code != 200:
         raise IOError("Failed to connect to GliderDAC Status API")
     data = response.json()['results']
-    df = pd.DataFrame([get_glider_days(s, year) for s in data])
+    # Use the catalog's time extents and only fall back to the per-dataset
+    # metadata when a deployment isn't listed
+    catalog = ErddapCatalog.fetch(app.config['ERDDAP_URL'])
+    df = pd.DataFrame([get_glider_days(s, year, catalog) for s in data])
 
     return df[df.glider_days != 0].to_csv(index=False)
 
 
-def get_glider_days(glider_res, year=None):
+def get_glider_days(glider_res, year=None, catalog=None):
     '''
     Returns a dict of of total days of glider deployments per operator
 
     :param dict glider_res: Dictionary of deployment stats from an operator
     :param int year: Integer of the year you want the stats from
+    :param ErddapCatalog catalog: Optional allDatasets snapshot to read the
+                                  time coverage from
     '''
     # If year is not passed in, just do the current year
     if year is None:
@@ -53,20 +61,30 @@ def get_glider_days(glider_res, year=None):
     rtn_struct['glider_days'] = 0
     templ = 'https://data.ioos.us/gliders/erddap/info/{}/index.csv'
 
-    try:
-        meta = pd.read_csv(templ.format(rtn_struct['deployment']),
-                           index_col='Attribute Name')
-    except:
-        rtn_struct['glider_days'] = -2
-        return rtn_struct
-    try:
-        start_time = pd.to_datetime(meta.loc['time_coverage_start'].Value)
-        end_time = pd.to_datetime(meta.loc['time_coverage_end'].Value)
-    except KeyError:
-        # if there's no coverage start/end, then it's hard to determine the
-        # exact number of days
-        rtn_struct['glider_days'] = -1
-        return rtn_struct
+    min_time = max_time = None
+    if catalog is not None and rtn_struct['deployment'] in catalog:
+        min_time = catalog.get(rtn_struct['deployment'], 'minTime')
+        max_time = catalog.get(rtn_struct['deployment'], 'maxTime')
+    if min_time and max_time:
+        start_time = pd.to_datetime(min_time)
+        end_time = pd.to_datetime(max_time)
+    else:
+        try:
+            response = http_client.get(templ.format(rtn_struct['deployment']))
+            response.raise_for_status()
+            meta = pd.read_csv(io.StringIO(response.text),
+                               index_col='Attribute Name')
+        except:
+            rtn_struct['glider_days'] = -2
+            return rtn_struct
+        try:
+            start_time = pd.to_datetime(meta.loc['time_coverage_start'].Value)
+            end_time = pd.to_datetime(meta.loc['time_coverage_end'].Value)
+        except KeyError:
+            # if there's no coverage start/end, then it's hard to determine the
+            # exact number of days
+            rtn_struct['glider_days'] = -1
+            return rtn_struct
 
     if end_time < pd.Timestamp(year_start_str):
         rtn_struct['glider_days'] = 0
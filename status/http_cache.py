@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+'''
+status.http_cache
+
+A persistent, size-bounded cache of HTTP responses on disk. Each URL pattern
+has its own time to live; stale entries are revalidated with ETag and
+Last-Modified validators so unchanged documents come back as a 304.
+'''
+
+from requests.structures import CaseInsensitiveDict
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import requests
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    '''
+    Stores response bodies and their validators in a directory, evicting the
+    least recently used entries once the directory grows past max_bytes
+    '''
+
+    def __init__(self, directory, ttls, max_bytes=512 * 1024 * 1024):
+        '''
+        :param str directory: Directory the cache entries are written to
+        :param list ttls: List of (regex, seconds) pairs. The first pattern
+                          that matches a URL sets its time to live. URLs that
+                          match no pattern are not cached.
+        :param int max_bytes: Maximum total size of the cached bodies
+        '''
+        self.directory = directory
+        self.ttls = [(re.compile(pattern), seconds)
+                     for pattern, seconds in ttls]
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get_ttl(self, url):
+        '''
+        Returns the time to live of a URL in seconds or None if it isn't
+        cacheable
+
+        :param str url: Request URL
+        '''
+        for pattern, seconds in self.ttls:
+            if pattern.search(url):
+                return seconds
+        return None
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def load(self, url):
+        '''
+        Returns the cache entry metadata for a URL or None
+
+        :param str url: Request URL
+        '''
+        path = self._path(url)
+        try:
+            with open(path + '.json', 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(path + '.body'):
+            return None
+        return entry
+
+    def is_fresh(self, entry, ttl):
+        '''
+        Returns True if an entry can be used without revalidating it
+
+        :param dict entry: Cache entry metadata
+        :param int ttl: Time to live in seconds
+        '''
+        return time.time() - entry['fetched_at'] < ttl
+
+    def validators(self, entry):
+        '''
+        Returns the conditional request headers for a cache entry
+
+        :param dict entry: Cache entry metadata
+        '''
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def response(self, entry):
+        '''
+        Returns a requests Response built from a cache entry and marks the
+        entry as recently used. Returns None if the entry was evicted since
+        it was loaded.
+
+        :param dict entry: Cache entry metadata
+        '''
+        path = self._path(entry['url'])
+        try:
+            with open(path + '.body', 'rb') as f:
+                content = f.read()
+            now = time.time()
+            os.utime(path + '.json', (now, now))
+        except FileNotFoundError:
+            return None
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry['url']
+        response.encoding = entry.get('encoding')
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response._content = content
+        response._content_consumed = True
+        response.raw = io.BytesIO(content)
+        return response
+
+    def touch(self, entry):
+        '''
+        Restarts an entry's time to live after a successful revalidation
+
+        :param dict entry: Cache entry metadata
+        '''
+        entry['fetched_at'] = time.time()
+        self._write(self._path(entry['url']) + '.json',
+                    json.dumps(entry).encode('utf-8'))
+
+    def store(self, url, response):
+        '''
+        Saves a 200 response
+
+        :param str url: Request URL
+        :param requests.Response response: The response to store
+        '''
+        entry = {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'encoding': response.encoding,
+            'headers': {
+                k: v for k, v in response.headers.items()
+                if k.lower() in ('content-type', 'etag', 'last-modified')
+            }
+        }
+        path = self._path(url)
+        self._write(path + '.body', response.content)
+        self._write(path + '.json', json.dumps(entry).encode('utf-8'))
+        self.evict()
+
+    def _write(self, path, data):
+        '''
+        Writes data to path atomically
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cached bodies fit
+        in max_bytes
+        '''
+        with self._lock:
+            entries = []
+            total = 0
+            for item in os.scandir(self.directory):
+                if not item.name.endswith('.body'):
+                    continue
+                key = item.name[:-len('.body')]
+                try:
+                    size = item.stat().st_size
+                    used = os.stat(os.path.join(self.directory,
+                                                key + '.json')).st_mtime
+                except FileNotFoundError:
+                    used = 0
+                    size = 0
+                entries.append((used, size, key))
+                total += size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for used, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                for ext in ('.json', '.body'):
+                    try:
+                        os.remove(os.path.join(self.directory, key + ext))
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                logger.debug('Evicted %s from the response cache', key)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+'''
+status.http_client
+
+The shared HTTP client used for every outbound request. Connections are kept
+alive and pooled, requests to a single host are capped, transient 429/5xx
+responses are retried with backoff and per-host metrics are collected.
+Responses for the URL patterns configured under HTTP_CACHE are kept in a
+persistent on-disk cache.
+'''
+
+from app import app
+from status.http_cache import ResponseCache
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+import logging
+import os
+import requests
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class HttpClient(object):
+    '''
+    A thread-safe wrapper around a pooled requests Session
+    '''
+
+    def __init__(self, timeout=60, retries=3, backoff_factor=0.5,
+                 pool_size=16, per_host_limit=8, cache=None):
+        '''
+        :param float timeout: Default timeout in seconds
+        :param int retries: Number of retries on connection errors and
+                            429/5xx responses
+        :param float backoff_factor: Exponential backoff factor in seconds
+        :param int pool_size: Number of keep-alive connections kept per host
+        :param int per_host_limit: Maximum concurrent requests to a single host
+        :param ResponseCache cache: Optional on-disk response cache
+        '''
+        self.pid = os.getpid()
+        self.timeout = timeout
+        self.per_host_limit = per_host_limit
+        self.cache = cache
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_limits = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, host):
+        '''
+        Returns the semaphore guarding a host
+        '''
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(
+                    self.per_host_limit)
+            return self._host_limits[host]
+
+    def _host_metrics(self, host):
+        '''
+        Returns the metrics of a host. The caller must hold the lock.
+        '''
+        return self._metrics.setdefault(host, {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+            'cache_hits': 0,
+            'not_modified': 0
+        })
+
+    def _count(self, host, key):
+        '''
+        Increments a single counter of a host's metrics
+        '''
+        with self._lock:
+            self._host_metrics(host)[key] += 1
+
+    def _record(self, host, elapsed, response=None, stream=False):
+        '''
+        Adds a request to the host's metrics
+        '''
+        with self._lock:
+            metrics = self._host_metrics(host)
+            metrics['requests'] += 1
+            metrics['seconds'] += elapsed
+            if response is None or response.status_code >= 400:
+                metrics['errors'] += 1
+            if response is None:
+                return
+            retries = getattr(response.raw, 'retries', None)
+            if retries is not None:
+                metrics['retries'] += len(retries.history)
+            # Streamed bodies haven't been read yet
+            if not stream:
+                metrics['bytes'] += len(response.content or b'')
+
+    def get(self, url, **kwargs):
+        '''
+        Issues a GET request and returns the requests Response. Accepts the
+        same keyword arguments as requests.get.
+
+        Cacheable URLs are answered from the response cache while fresh and
+        revalidated with a conditional request once stale.
+
+        :param str url: URL to request
+        '''
+        ttl = None
+        if (self.cache is not None and not kwargs.get('stream') and
+                not kwargs.get('params')):
+            ttl = self.cache.get_ttl(url)
+        if ttl is None:
+            return self._get(url, **kwargs)
+
+        host = urlparse(url).netloc
+        headers = dict(kwargs.pop('headers', None) or {})
+        no_cache = 'no-cache' in headers.get('Cache-Control', '')
+        entry = self.cache.load(url)
+        if entry is not None and not no_cache and self.cache.is_fresh(entry, ttl):
+            response = self.cache.response(entry)
+            if response is not None:
+                self._count(host, 'cache_hits')
+                return response
+            # Evicted by another thread or process, fetch it again
+            entry = None
+
+        conditional = dict(headers)
+        if entry is not None:
+            conditional.update(self.cache.validators(entry))
+        response = self._get(url, headers=conditional, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            cached = self.cache.response(entry)
+            if cached is not None:
+                self._count(host, 'not_modified')
+                self.cache.touch(entry)
+                return cached
+            # The body was evicted after the conditional request was sent
+            response = self._get(url, headers=headers, **kwargs)
+        # Without a TTL the entry is only useful if it can be revalidated
+        if response.status_code == 200 and (
+                ttl > 0 or response.headers.get('ETag') or
+                response.headers.get('Last-Modified')):
+            self.cache.store(url, response)
+        return response
+
+    def _get(self, url, **kwargs):
+        '''
+        Issues a GET request over the pooled session
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        start = time.time()
+        with self._host_limit(host):
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.RequestException:
+                self._record(host, time.time() - start)
+                raise
+        self._record(host, time.time() - start, response,
+                     kwargs.get('stream', False))
+        return response
+
+    @property
+    def metrics(self):
+        '''
+        Returns a copy of the request metrics keyed by host
+        '''
+        with self._lock:
+            return {host: dict(m) for host, m in self._metrics.items()}
+
+    def log_metrics(self, log=logger):
+        '''
+        Logs a line of metrics for every upstream host
+
+        :param logging.Logger log: Logger to write to
+        '''
+        for host, m in sorted(self.metrics.items()):
+            log.info('%s: %d requests, %d errors, %d retries, %d bytes, '
+                     '%.1f s, %d cache hits, %d not modified', host,
+                     m['requests'], m['errors'], m['retries'], m['bytes'],
+                     m['seconds'], m['cache_hits'], m['not_modified'])
+
+
+def get_client():
+    '''
+    Returns the process-wide HttpClient configured from the HTTP settings. A
+    new client is created after a fork so pooled sockets are never shared
+    between processes.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid():
+            config = app.config.get('HTTP') or {}
+            cache = None
+            cache_config = app.config.get('HTTP_CACHE')
+            if cache_config:
+                cache = ResponseCache(cache_config['DIRECTORY'],
+                                      cache_config.get('TTLS', []),
+                                      cache_config.get('MAX_BYTES',
+                                                       512 * 1024 * 1024))
+            _client = HttpClient(
+                timeout=config.get('TIMEOUT', 60),
+                retries=config.get('RETRIES', 3),
+                backoff_factor=config.get('BACKOFF_FACTOR', 0.5),
+                pool_size=config.get('POOL_SIZE', 16),
+                per_host_limit=config.get('PER_HOST_LIMIT', 8),
+                cache=cache)
+        return _client
+
+
+def get(url, **kwargs):
+    '''
+    Issues a GET request with the shared client
+
+    :param str url: URL to request
+    '''
+    return get_client().get(url, **kwargs)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+status.inventory
+
+Keeps an inventory of the NetCDF files in each deployment directory under
+FILE_DIR. A directory is only rescanned when its own mtime changes, which
+happens whenever a file is added, removed or renamed in it.
+'''
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Directories modified this close to the last scan are rescanned because a
+# change in the same mtime tick wouldn't be visible
+MTIME_SAFETY_WINDOW = 2
+
+
+def scan_directory(path, extension='.nc'):
+    '''
+    Returns a dictionary with the number of files with the extension in path,
+    the name of the most recently modified one and its mtime, using a single
+    pass over the directory
+
+    :param str path: Directory to scan
+    :param str extension: File extension to match
+    '''
+    count = 0
+    latest = None
+    latest_mtime = None
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        entries = None
+    if entries is not None:
+        with entries:
+            for entry in entries:
+                # Match glob('*.nc'), which skips hidden files
+                if (entry.name.startswith('.') or
+                        not entry.name.endswith(extension)):
+                    continue
+                count += 1
+                mtime = entry.stat().st_mtime
+                if latest_mtime is None or mtime > latest_mtime:
+                    latest = entry.name
+                    latest_mtime = mtime
+    return {
+        'count': count,
+        'latest': latest,
+        'latest_mtime': latest_mtime
+    }
+
+
+class FileInventory(object):
+    '''
+    A cache of directory scans keyed by path that is persisted between runs
+    '''
+
+    def __init__(self, cache_file=None):
+        '''
+        :param str cache_file: Optional JSON file the inventory is saved to
+        '''
+        self.cache_file = cache_file
+        self.entries = {}
+        self.scans = 0
+        self._lock = threading.Lock()
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logger.exception('Failed to read inventory %s', cache_file)
+
+    def get(self, path):
+        '''
+        Returns the inventory of a directory, rescanning it only if it has
+        changed since the last scan
+
+        :param str path: Directory to inventory
+        '''
+        try:
+            dir_mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            dir_mtime = None
+        with self._lock:
+            entry = self.entries.get(path)
+        if (entry is not None and dir_mtime is not None and
+                entry['dir_mtime'] == dir_mtime and
+                entry['scanned_at'] - dir_mtime > MTIME_SAFETY_WINDOW):
+            return entry
+
+        scanned_at = time.time()
+        entry = scan_directory(path)
+        entry['dir_mtime'] = dir_mtime
+        entry['scanned_at'] = scanned_at
+        with self._lock:
+            self.entries[path] = entry
+            self.scans += 1
+        return entry
+
+    def save(self):
+        '''
+        Writes the inventory to the cache file
+        '''
+        if self.cache_file is None:
+            return
+        cache_dir = os.path.dirname(self.cache_file) or '.'
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with self._lock:
+            data = json.dumps(self.entries)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_file)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+'''
+status.land_mask
+
+Tests whether coordinates fall on land using the Natural Earth land polygons.
+The polygons are prepared and indexed in an STRtree so a whole array of
+coordinates is tested at once against only the polygons whose bounding boxes
+contain them.
+
+RasterLandMask is a faster, approximate alternative: the polygons are
+rasterized once into a bit-packed global grid that is memory-mapped, so every
+process shares the same pages. Cells the coastline passes through fall back to
+the exact polygon test.
+
+The polygons are loaded on first use rather than at import. Parsing the
+shapefile is slow, so a WKB copy is kept in the cache directory and read
+instead when it exists. Delete it to pick up new Natural Earth data.
+'''
+
+import logging
+import numpy as np
+import pickle
+import shapely
+import tempfile
+import threading
+
+import os
+os.environ["CARTOPY_USER_BACKGROUNDS"] = "/tmp/cartopy"
+os.environ["CARTOPY_DATA_DIR"] = "/tmp/cartopy"
+
+logger = logging.getLogger(__name__)
+
+LAND_CACHE_FILE = 'ne_10m_land.wkb'
+
+_land_masks = {}
+_lock = threading.RLock()
+
+
+def read_land_shapefile():
+    '''
+    Returns the 10m Natural Earth land polygons from the cartopy shapefile,
+    downloading it if necessary
+    '''
+    import cartopy.io.shapereader as shpreader
+    # Load higher-resolution land polygons for better accuracy
+    land_shp = shpreader.natural_earth(resolution='10m', category='physical', name='land')
+    return list(shpreader.Reader(land_shp).geometries())
+
+
+def load_land_geometries(cache_dir=None):
+    '''
+    Returns the land polygons, from the WKB cache in cache_dir when it exists
+    and from the shapefile otherwise, in which case the cache is written
+
+    :param str cache_dir: Directory of the WKB cache, or None to always read
+                          the shapefile
+    '''
+    if cache_dir is None:
+        return read_land_shapefile()
+    path = os.path.join(cache_dir, LAND_CACHE_FILE)
+    try:
+        with open(path, 'rb') as f:
+            return list(shapely.from_wkb(pickle.load(f)))
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception('Failed to read %s, rebuilding it', path)
+
+    geometries = read_land_shapefile()
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(shapely.to_wkb(geometries).tolist(), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return geometries
+
+
+class LandMask(object):
+    '''
+    A spatial index of prepared land polygons
+    '''
+
+    def __init__(self, geometries):
+        '''
+        :param list geometries: Shapely land polygons
+        '''
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def contains(self, lon, lat):
+        '''
+        Returns a boolean array that is True where the coordinate is on land.
+        Missing coordinates are never on land.
+
+        :param numpy.ndarray lon: Longitudes
+        :param numpy.ndarray lat: Latitudes
+        '''
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        on_land = np.zeros(lon.shape, dtype=bool)
+        valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if valid.size == 0:
+            return on_land
+        x = lon.ravel()[valid]
+        y = lat.ravel()[valid]
+
+        # Candidate (point, polygon) pairs from the bounding box index, then
+        # the exact test for only those pairs
+        point_idx, geom_idx = self.tree.query(shapely.points(x, y))
+        hits = shapely.contains_xy(self.geometries[geom_idx],
+                                   x[point_idx], y[point_idx])
+        on_land.ravel()[valid[point_idx[hits]]] = True
+        return on_land
+
+
+class RasterLandMask(object):
+    '''
+    A memory-mapped global grid with a land and a coast bit per cell. Points in
+    land or sea cells are answered from the grid; points in coast cells, or
+    outside the grid, are passed to the exact land mask.
+    '''
+
+    LAND = 0
+    COAST = 1
+
+    def __init__(self, path, exact):
+        '''
+        :param str path: Path of a grid written by build
+        :param exact: LandMask, or a callable returning one, used for coast
+                      cells. A callable is only called if a point needs it.
+        '''
+        self.grid = np.load(path, mmap_mode='r')
+        self.nrows = self.grid.shape[1]
+        self.ncols = 2 * self.nrows
+        self.resolution = 180.0 / self.nrows
+        self._exact = exact
+
+    @property
+    def exact(self):
+        '''
+        Returns the exact LandMask used for coast cells
+        '''
+        if not isinstance(self._exact, LandMask):
+            self._exact = self._exact()
+        return self._exact
+
+    @classmethod
+    def build(cls, land_mask, path, resolution=0.1):
+        '''
+        Rasterizes the polygons of a LandMask and saves the grid to path
+
+        :param LandMask land_mask: The exact land mask
+        :param str path: Destination of the .npy grid
+        :param float resolution: Cell size in degrees. 180 must be a multiple
+                                 of it.
+        '''
+        nrows = int(round(180.0 / resolution))
+        ncols = 2 * nrows
+        resolution = 180.0 / nrows
+
+        # A cell is land if its center is. That is exact for every cell the
+        # coastline doesn't pass through.
+        land = np.zeros((nrows, ncols), dtype=bool)
+        lon = -180.0 + (np.arange(ncols) + 0.5) * resolution
+        for row in range(nrows):
+            lat = np.full(ncols, -90.0 + (row + 0.5) * resolution)
+            land[row] = land_mask.contains(lon, lat)
+
+        # Mark every cell containing a boundary vertex, with the boundaries
+        # densified so no cell is crossed without one, then grow the marked
+        # cells by one to cover segments that clip a cell corner
+        coast = np.zeros((nrows, ncols), dtype=bool)
+        boundaries = shapely.segmentize(
+            shapely.boundary(land_mask.geometries), resolution / 2)
+        coords = shapely.get_coordinates(boundaries)
+        rows = np.clip(((coords[:, 1] + 90.0) / resolution).astype(int),
+                       0, nrows - 1)
+        cols = np.clip(((coords[:, 0] + 180.0) / resolution).astype(int),
+                       0, ncols - 1)
+        coast[rows, cols] = True
+        grown = coast.copy()
+        for shift in (-1, 1):
+            grown |= np.roll(coast, shift, axis=1)
+        coast = grown.copy()
+        grown[1:] |= coast[:-1]
+        grown[:-1] |= coast[1:]
+
+        grid = np.stack([np.packbits(land, axis=1),
+                         np.packbits(grown, axis=1)])
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, grid)
+        os.replace(tmp_path, path)
+
+    def _bits(self, layer, rows, cols):
+        byte = self.grid[layer, rows, cols >> 3]
+        return ((byte >> (7 - (cols & 7))) & 1).astype(bool)
+
+    def contains(self, lon, lat):
+        '''
+        Returns a boolean array that is True where the coordinate is on land.
+        Missing coordinates are never on land.
+
+        :param numpy.ndarray lon: Longitudes
+        :param numpy.ndarray lat: Latitudes
+        '''
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        shape = lon.shape
+        lon = lon.ravel()
+        lat = lat.ravel()
+        on_land = np.zeros(lon.shape, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            rows = np.floor((lat + 90.0) / self.resolution)
+            cols = np.floor((lon + 180.0) / self.resolution)
+        inside = ((rows >= 0) & (rows < self.nrows) &
+                  (cols >= 0) & (cols < self.ncols))
+        idx = np.flatnonzero(inside)
+        rows = rows[idx].astype(int)
+        cols = cols[idx].astype(int)
+
+        coast = self._bits(self.COAST, rows, cols)
+        on_land[idx[~coast]] = self._bits(self.LAND, rows[~coast],
+                                          cols[~coast])
+        exact = np.isfinite(lon) & np.isfinite(lat) & ~inside
+        exact[idx[coast]] = True
+        if exact.any():
+            on_land[exact] = self.exact.contains(lon[exact], lat[exact])
+        return on_land.reshape(shape)
+
+
+def get_land_mask(mode='exact', cache_dir=None, resolution=0.1):
+    '''
+    Returns the land mask of the Natural Earth land polygons
+
+    :param str mode: 'exact' for polygon tests or 'raster' for the gridded
+                     lookup table
+    :param str cache_dir: Directory of the polygon and raster caches, built
+                          on first use
+    :param float resolution: Raster cell size in degrees
+    '''
+    key = (mode, cache_dir, resolution)
+    with _lock:
+        if key in _land_masks:
+            return _land_masks[key]
+        if mode == 'exact':
+            land_mask = LandMask(load_land_geometries(cache_dir))
+        elif mode == 'raster':
+            path = os.path.join(cache_dir or tempfile.gettempdir(),
+                                'ne_10m_land_{:g}.npy'.format(resolution))
+            if not os.path.exists(path):
+                RasterLandMask.build(get_land_mask('exact', cache_dir), path,
+                                     resolution)
+            land_mask = RasterLandMask(
+                path, lambda: get_land_mask('exact', cache_dir))
+        else:
+            raise ValueError('Unknown land mask mode: {}'.format(mode))
+        _land_masks[key] = land_mask
+        return land_mask
@@ -4,11 +4,12 @@
 
 import boto3
 import json
-import requests
 import sys
 from datetime import datetime, timedelta
 from flask import current_app
 from aws.docker.worker.generate_profile_plot import generate_profile_plot
+from status.erddap import ErddapCatalog
+from status import http_client
 
 
 def iter_deployments():
@@ -18,7 +19,7 @@ def iter_deployments():
     '''
     url = 'https://gliders.ioos.us/status/static/json/status.json'
     headers = {'Cache-Control': 'no-cache'}
-    response = requests.get(url, headers=headers, timeout=20)
+    response = http_client.get(url, headers=headers, timeout=20)
     response.raise_for_status()
     results = response.json()
     for deployment in results['datasets']:
@@ -67,6 +68,8 @@ def generate_profile_plots(deployments=None, use_sqs=False):
         aws_secret_access_key=current_app.config['AWS']['SECRET_ACCESS_KEY'],
     )
     queue_url = current_app.config['AWS']['SQS_QUEUE_URL']
+    # One catalog snapshot provides the time extents of every dataset
+    catalog = ErddapCatalog.fetch(current_app.config['ERDDAP_URL'])
 
     for deployment in iter_deployments():
         try:
@@ -85,7 +88,8 @@ def generate_profile_plots(deployments=None, use_sqs=False):
                 not deployment["completed"])):
                 # Send message to SQS queue
                 message_body = dict(
-                    erddap_dataset=deployment['erddap']
+                    erddap_dataset=deployment['erddap'],
+                    checksum=deployment.get('checksum')
                 )
                 # TODO: consider binding to a higher order function
                 if use_sqs:
@@ -95,7 +99,13 @@ def generate_profile_plots(deployments=None, use_sqs=False):
                         MessageBody=json.dumps(message_body)
                     )
                 else:
-                    generate_profile_plot(deployment["erddap"])
+                    time_extents = None
+                    if catalog is not None and deployment['name'] in catalog:
+                        time_extents = (
+                            catalog.get(deployment['name'], 'minTime'),
+                            catalog.get(deployment['name'], 'maxTime'))
+                    generate_profile_plot(deployment["erddap"], time_extents,
+                                          deployment.get('checksum'))
         except Exception:
             from traceback import print_exc
             print_exc()
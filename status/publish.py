@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+'''
+status.publish
+
+Publishes JSON documents for the web application. Documents are written to
+temporary files and renamed into place so readers never see a partial write.
+Precompressed gzip and brotli copies and a content-hash ETag are written next
+to each document so it can be served with content negotiation and
+conditional GET support.
+'''
+
+from flask import abort, send_file
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content-Encoding to file suffix in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def set_default_mode(path):
+    '''
+    Gives a file created by tempfile.mkstemp, which is only readable by its
+    owner, the permissions open() would have given it under the current umask
+
+    :param str path: Path of the file
+    '''
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(path, 0o666 & ~umask)
+
+
+def publish_json(data, path):
+    '''
+    Writes data as JSON to path along with its .gz, .br (if brotli is
+    installed) and .etag companions and returns the ETag
+
+    :param data: A JSON serializable python object
+    :param str path: Destination of the JSON document
+    '''
+    directory = os.path.dirname(path) or '.'
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    # Encoded in one call so the C accelerated encoder is used
+    body = json.dumps(data).encode('utf-8')
+    temp_paths = {}
+    files = {}
+    try:
+        for suffix in ('', '.gz', '.br', '.etag'):
+            if suffix == '.br' and brotli is None:
+                continue
+            fd, temp_paths[suffix] = tempfile.mkstemp(dir=directory,
+                                                      suffix='.tmp')
+            files[suffix] = os.fdopen(fd, 'wb')
+            set_default_mode(temp_paths[suffix])
+        files[''].write(body)
+        with gzip.GzipFile(fileobj=files['.gz'], mode='wb', mtime=0) as gz:
+            gz.write(body)
+        if brotli is not None:
+            files['.br'].write(brotli.compress(body))
+
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        files['.etag'].write(etag.encode('utf-8'))
+        for f in files.values():
+            f.close()
+
+        # Swap the compressed copies in before the document and the ETag last
+        # so a new ETag is never served with an old body
+        for suffix in ('.gz', '.br', '', '.etag'):
+            if suffix in temp_paths:
+                os.replace(temp_paths.pop(suffix), path + suffix)
+    finally:
+        for f in files.values():
+            f.close()
+        for temp_path in temp_paths.values():
+            os.remove(temp_path)
+    if brotli is None and os.path.exists(path + '.br'):
+        # Don't leave a stale brotli copy behind
+        os.remove(path + '.br')
+    return etag
+
+
+def read_etag(path):
+    '''
+    Returns the published ETag of a JSON document or None
+
+    :param str path: Path of the JSON document
+    '''
+    try:
+        with open(path + '.etag', 'r') as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def send_published_json(path, request):
+    '''
+    Returns a Flask response serving a published JSON document, choosing the
+    precompressed copy the client accepts and answering conditional requests
+
+    :param str path: Path of the JSON document
+    :param flask.Request request: The request being answered
+    '''
+    path = os.path.abspath(path)
+    if not os.path.exists(path):
+        # Nothing has been published yet
+        abort(404)
+    etag = read_etag(path)
+    if etag is None:
+        return send_file(path, mimetype='application/json', conditional=True)
+
+    encoding = None
+    file_path = path
+    for name, suffix in ENCODINGS:
+        if (name in request.accept_encodings and
+                os.path.exists(path + suffix)):
+            encoding = name
+            file_path = path + suffix
+            break
+
+    response = send_file(file_path, mimetype='application/json',
+                         conditional=False)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+        etag = '{}-{}'.format(etag, encoding)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+status.single_flight
+
+Collapses concurrent calls for the same key into one call whose result, or
+exception, is shared by every caller. De-duplication is per process.
+'''
+
+import threading
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    Runs at most one call per key at a time
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        '''
+        Calls func(*args, **kwargs) unless a call for key is already running,
+        in which case its result is waited for and returned instead
+
+        :param key: Hashable identifying the work
+        :param func: Callable doing the work
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = func(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -3,11 +3,19 @@
 status.tasks
 '''
 from app import app
-from celery import shared_task
+from celery import chord, shared_task
 from datetime import datetime
+from functools import partial
 from celery.utils.log import get_task_logger
 from status.profile_plots import generate_profile_plots
-from status.trajectories import generate_trajectories
+from status.trajectories import (generate_trajectories, select_trajectories,
+                                 build_deployment_trajectory, get_time_extents,
+                                 add_result, finish_summary)
+from status.fetch_pool import FetchPool
+from status import http_client
+from status.erddap import ErddapCatalog, get_profile_summary
+from status.inventory import FileInventory
+from status.publish import publish_json
 from urllib.parse import urlencode
 import status.clocks as clock
 import json
@@ -15,9 +23,8 @@ import os
 import logging
 import time
 import re
+import tempfile
 import collections
-import requests
-import glob
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -37,10 +44,84 @@ def write_json(data):
         logger.error('JSON FILE IS NONE')
         return False
 
-    with open(json_file, 'w') as f:
-        f.write(json.dumps(data))
+    etag = publish_json(data, json_file)
 
-    logger.info('Updated %s', json_file)
+    logger.info('Updated %s (%s)', json_file, etag)
+    return True
+
+
+def load_status_cache():
+    '''
+    Returns the per-deployment records saved by the previous status run keyed
+    by DAC deployment id, or an empty dict if there is no usable cache
+    '''
+    cache_file = app.config.get('STATUS_CACHE')
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        logger.exception('Failed to read status cache %s', cache_file)
+        return {}
+
+
+def write_status_cache(cache):
+    '''
+    Saves the per-deployment records for the next incremental status run
+
+    :param dict cache: Cache entries keyed by DAC deployment id
+    '''
+    cache_file = app.config.get('STATUS_CACHE')
+    if cache_file is None:
+        return
+    cache_dir = os.path.dirname(cache_file) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written atomically because refresh_deployment can run alongside the
+    # scheduled status update
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_file)
+
+
+def get_fingerprint(dac_record, catalog, file_dir=None):
+    '''
+    Returns the values that change whenever a deployment's status record
+    would: the DAC updated time and checksum, the ERDDAP maxTime and the
+    mtime of the deployment directory, which changes when files are added
+    and is what FileInventory rescans on
+
+    :param dict dac_record: Deployment metadata from the DAC API
+    :param ErddapCatalog catalog: The ERDDAP allDatasets snapshot
+    :param str file_dir: Directory holding the deployment directories
+    '''
+    max_time = catalog.get(dac_record['name'], 'maxTime')
+    dir_mtime = None
+    if file_dir is not None and dac_record.get('deployment_dir'):
+        try:
+            dir_mtime = os.stat(os.path.join(file_dir,
+                                             dac_record['deployment_dir'])).st_mtime
+        except OSError:
+            pass
+    return [dac_record.get('updated'), dac_record.get('checksum'), max_time,
+            dir_mtime]
+
+
+def is_cached(cache, dac_record, fingerprint):
+    '''
+    Returns True if the cached record for the deployment can be reused
+
+    :param dict cache: Cache entries keyed by DAC deployment id
+    :param dict dac_record: Deployment metadata from the DAC API
+    :param list fingerprint: The deployment's current fingerprint
+    '''
+    entry = cache.get(dac_record['id'])
+    if entry is None or entry['fingerprint'] != fingerprint:
+        return False
+    max_age = app.config.get('STATUS_CACHE_MAX_AGE')
+    if max_age is not None and time.time() - entry['cached_at'] > max_age:
+        return False
     return True
 
 
@@ -51,16 +132,107 @@ def generate_dac_profile_plots():
 
 @shared_task
 def get_trajectory_features():
-    return generate_trajectories()
+    '''
+    Builds the trajectories of the selected deployments as a chord of one
+    subtask per deployment, so the cleaning of different tracks runs in
+    parallel across the Celery worker processes. The summary is produced by
+    summarize_trajectories once every subtask has finished.
+    '''
+    start_time = time.time()
+    catalog = ErddapCatalog.fetch(app.config['ERDDAP_URL'])
+    selected, summary = select_trajectories()
+    if not selected:
+        return finish_summary(summary, start_time)
+    header = [get_deployment_trajectory.s(deployment,
+                                          get_time_extents(deployment, catalog))
+              for deployment in selected]
+    return chord(header)(summarize_trajectories.s(summary, start_time)).id
+
+
+@shared_task
+def get_deployment_trajectory(deployment, time_extents=None, rebuild=False):
+    '''
+    Builds the trajectory of one deployment and returns its summary entry
+    '''
+    return build_deployment_trajectory(deployment, time_extents, rebuild)
 
 
 @shared_task
-def get_dac_status(time_limit=600):
+def summarize_trajectories(results, summary, start_time):
+    '''
+    Combines the summary entries of get_deployment_trajectory subtasks
+    '''
+    for result in results:
+        add_result(summary, result)
+    return finish_summary(summary, start_time)
+
+
+DEPLOYMENT_URL_TEMPLATE = 'https://gliders.ioos.us/providers/deployment/{:s}'
+TDS_URL_TEMPLATE = 'https://gliders.ioos.us/thredds/dodsC/deployments/{:s}/{:s}/catalog.html?dataset=deployments/{:s}/{:s}/{:s}.nc3.nc'
+
+# ERDDAP allDatasets columns and the status keys they map to
+ERDDAP_VARIABLES = {
+    'datasetID': 'datasetID',
+    'institution': 'institution',
+    'title': 'title',
+    'minLongitude': 'west',
+    'maxLongitude': 'east',
+    'minLatitude': 'south',
+    'maxLatitude': 'north',
+    'minTime': 'ts0',
+    'maxTime': 'ts1',
+    'subset': 'subset',
+    'tabledap': 'tabledap',
+    'MakeAGraph': 'graph',
+    'fgdc': 'fgdc',
+    'metadata': 'meta',
+    'rss': 'rss',
+    'summary': 'summary'
+}
+
+# Time coverage regexs
+T0_RE = re.compile(
+    r'time_coverage_start\s"(\d{4}\-\d{2}\-\d{2}T\d{2}:\d{2}:\d{2}Z)"')
+T1_RE = re.compile(
+    r'time_coverage_end\s"(\d{4}\-\d{2}\-\d{2}T\d{2}:\d{2}:\d{2}Z)"')
+ISO_TIME_RE = re.compile(r'^\d{4}\-\d{2}\-\d{2}T\d{2}:\d{2}:\d{2}Z$')
+
+
+@shared_task
+def refresh_deployment(deployment_dir):
+    '''
+    Refreshes the status record, trajectory and profile plots of a single
+    deployment, e.g. after new files were uploaded for it
+
+    :param str deployment_dir: The deployment directory under FILE_DIR
+    '''
+    status = get_dac_status(refresh=[deployment_dir])
+    name = deployment_dir.rstrip('/').split('/')[-1]
+    generate_trajectories([name])
+    generate_profile_plots([deployment_dir])
+    return status
+
+
+@shared_task
+def get_dac_status(time_limit=600, incremental=None, refresh=None):
+    '''
+    Builds the status record of every DAC deployment and writes them to
+    STATUS_JSON
+
+    :param int time_limit: Unused
+    :param bool incremental: Reuse the previous run's records for deployments
+                             that have not changed. Defaults to the
+                             STATUS_INCREMENTAL setting.
+    :param list refresh: deployment_dir values that are always rebuilt
+    '''
+    if incremental is None:
+        incremental = app.config.get('STATUS_INCREMENTAL', True)
     dac_api_url = app.config.get('DAC_API')
     erddap_url = app.config.get('ERDDAP_URL')
     file_dir = app.config.get('FILE_DIR')
-    deployment_url_template = 'https://gliders.ioos.us/providers/deployment/{:s}'
-    tds_url_template = 'https://gliders.ioos.us/thredds/dodsC/deployments/{:s}/{:s}/catalog.html?dataset=deployments/{:s}/{:s}/{:s}.nc3.nc'
+    fetcher = FetchPool(app.config.get('STATUS_FETCH_WORKERS', 8))
+    inventory = FileInventory(app.config.get('INVENTORY_CACHE'))
+    start_time = time.time()
     deployments = {
         'meta': {
             'fetch_time': time.strftime('%b %d, %Y %H:%M Z', time.gmtime())
@@ -68,47 +240,20 @@ def get_dac_status(time_limit=600):
         'datasets': []
     }
 
-    variables = {
-        'datasetID': 'datasetID',
-        'institution': 'institution',
-        'title': 'title',
-        'minLongitude': 'west',
-        'maxLongitude': 'east',
-        'minLatitude': 'south',
-        'maxLatitude': 'north',
-        'minTime': 'ts0',
-        'maxTime': 'ts1',
-        'subset': 'subset',
-        'tabledap': 'tabledap',
-        'MakeAGraph': 'graph',
-        'fgdc': 'fgdc',
-        'metadata': 'meta',
-        'rss': 'rss',
-        'summary': 'summary'
-    }
-    columns = list(variables.keys())
-    # Time coverage regexs
-    t0_re = re.compile(
-        'time_coverage_start\s"(\d{4}\-\d{2}\-\d{2}T\d{2}:\d{2}:\d{2}Z)"')
-    t1_re = re.compile(
-        'time_coverage_end\s"(\d{4}\-\d{2}\-\d{2}T\d{2}:\d{2}:\d{2}Z)"')
     # Request the dac deployments metadata
     logger.info('Fetching DAC deployments: %s', dac_api_url)
-    dac_request = requests.get(dac_api_url, timeout=60)
+    dac_request = fetcher.get(dac_api_url, timeout=60)
     if dac_request.status_code != 200:
         logger.error('ERDDAP request failed: %s (%s)',
                      dac_api_url, dac_request.reason)
         return False
 
     # Request the ERDDAP dataset metadata
-    logger.info('Fetching ERDDAP datasets: %s', erddap_url)
-    erddap_request = requests.get(erddap_url)
-    if erddap_request.status_code != 200:
-        logger.error('DAC request failed: %s (%s)',
-                     erddap_url, erddap_request.reason)
+    catalog = ErddapCatalog.fetch(erddap_url, fetcher.get)
+    if catalog is None:
         return False
 
-    # Fetch the results from both requests
+    # Fetch the results from the DAC request
     try:
         dac_data = dac_request.json()['results']
         dac_request.close()
@@ -116,151 +261,200 @@ def get_dac_status(time_limit=600):
         logger.exception("Failed to convert DAC response from JSON")
         return False
 
-    try:
-        erddap_data = erddap_request.json()['table']
-        erddap_request.close()
-    except ValueError as e:
-        logger.exception("Failed to conver ERDDAP response from JSON")
-        return False
-
-    # ERDDAP tabledap url index
-    tabledap_index = erddap_data['columnNames'].index('tabledap')
-    # ERDDAP datasetID index
-    id_index = erddap_data['columnNames'].index('datasetID')
-    # Create a list of dataset ids
-    dataset_ids = [record[id_index] for record in erddap_data['rows']]
-
-    # Loop through each deployment in dac_data.  Add erddap_data metadata if an
-    # ERDDAP dataset exist
-    for dac_record in dac_data:
-
-        # Initialize the metadata record
-        meta = {variables[column]: None for column in columns}
-
-        # Initialize a few other keys
-        meta['status'] = None
-        meta['wmo_id'] = None
-        meta['num_profiles'] = 0
-        meta['ts0'] = None
-        meta['ts1'] = None
-        meta['start'] = None
-        meta['end'] = None
-
-        # Create and add the dac2.0 deployment url
-        meta['dac_url'] = deployment_url_template.format(dac_record['id'])
-
-        # If the dac deployment name is in the ERDDAP dataset_ids, make an ERDDAP
-        # request and fill in the missing metadata
-        if dac_record['name'] in dataset_ids:
-            i = dataset_ids.index(dac_record['name'])
-            for column in columns:
-                col_id = erddap_data['columnNames'].index(column)
-                meta[variables[column]] = erddap_data['rows'][i][col_id]
-
-            dataset_id = erddap_data['rows'][i][id_index]
-            das_url = '.'.join([erddap_data['rows'][i][tabledap_index], 'das'])
-
-            # Request the ERDDAP Data Attribute Structure (.das) document
-            logger.info('Fetching das: %s', das_url)
-            das_request = requests.get(das_url, timeout=60)
-            if das_request.status_code != 200:
-                logger.error('das request failed: %s (%s)',
-                             das_url, das_request.reason)
-                continue
-
-            # Parse the global:time_coverage_start attribute
-            t0_match = t0_re.search(das_request.text)
-            t0_epoch = None
-            if not t0_match:
-                logger.error(
-                    '%s: No time_coverage_start regex match', dataset_id)
-            else:
-                t0_epoch = clock.erddap_ts2epoch(t0_match.groups()[0])
-
-            # Parse the global:time_coverage_end attribute
-            t1_match = t1_re.search(das_request.text)
-            t1_epoch = None
-            if not t1_match:
-                logger.error(
-                    '%s: No time_coverage_end regex match', dataset_id)
-            else:
-                # Convert the time_coverage_end to epoch seconds and set the bootstrap
-                # contextual class
-                t1_epoch = clock.erddap_ts2epoch(t1_match.groups()[0])
-
-            # Add the time coverages
-            # badams: if a start or end time regex fails to match, don't try to
-            # access attributes
-            # TODO: May want to access time variable in lieu of
-            # time_coverage_start/time_coverage_end
-            if t0_match is not None:
-                meta['ts0'] = t0_match.groups()[0]
-                meta['start'] = t0_epoch * 1000
-            if t1_match is not None:
-                meta['ts1'] = t1_match.groups()[0]
-                meta['end'] = t1_epoch * 1000
-
-            if dataset_id.find('all') == -1 and dataset_id.find('development') == -1:
-                json_url = meta['tabledap'] + '.json'
-                data_url = '?'.join([json_url, 'wmo_id,profile_id'])
-                logger.info('Fetching data url: %s', data_url)
-                r = requests.get(data_url, timeout=120)
-                if r.status_code != 200:
-                    logger.error('Dataset fetch error: %s', r.reason)
-                    continue
-
-                data = r.json()
-                # Create an array of wmo ids returned by query
-                wmo_ids = [row[0] for row in data['table']['rows'] if row[0]]
-                if len(wmo_ids) > 0:
-                    meta['wmo_id'] = wmo_ids[0]
-
-                # Create an array of profile numbers
-                profiles = [row[1] for row in data['table']['rows'] if row[1]]
-                if len(profiles) > 0:
-                    meta['num_profiles'] = max(profiles)
-
-        for name in list(dac_record.keys()):
-            meta[name] = dac_record[name]
-
-        # Try to fetch the THREDDS .das to see if the dataset exists
-        tds_das_url = tds_url_template.format(meta['username'],
-                                              meta['name'],
-                                              meta['username'],
-                                              meta['name'],
-                                              meta['name'])
-        meta['potential_invalid_files'] = []
-        if file_dir is not None:
-            deployment_loc = os.path.join(file_dir, meta['deployment_dir'])
-            logger.info('Fetching DAC raw files from {}'.format(deployment_loc))
-            # count of all the netCDF files in the particular directory
-            dep_nc_files = glob.glob(os.path.join(deployment_loc, '*.nc'))
-            meta['nc_files_count'] = len(dep_nc_files)
-            try:
-                latest_nc_file = max(dep_nc_files, key=os.path.getmtime)
-            # if empty, set the netCDF files to None
-            except ValueError:
-                meta['latest_nc_file'] = None
-                meta['nc_file_last_update'] = None
-            else:
-                meta['latest_nc_file'] = os.path.basename(latest_nc_file)
-                latest = int(os.path.getmtime(latest_nc_file) * 1000)
-
-                meta['nc_file_last_update'] = latest
-        # if the file_dir variable is None, just leave the keys empty
+    # Reuse the previous run's record for deployments whose fingerprint has
+    # not changed and only rebuild the new or changed ones
+    previous = load_status_cache() if incremental else {}
+    fingerprints = [get_fingerprint(dac_record, catalog, file_dir)
+                    for dac_record in dac_data]
+    refresh = set(refresh or [])
+    stale = [i for i, dac_record in enumerate(dac_data)
+             if dac_record.get('deployment_dir') in refresh or
+             not is_cached(previous, dac_record, fingerprints[i])]
+
+    # Build each deployment record in parallel. The pool returns the records
+    # in the same order as dac_data so status.json is ordered as before.
+    built = fetcher.map(partial(get_deployment_status,
+                                catalog=catalog,
+                                fetcher=fetcher,
+                                file_dir=file_dir,
+                                inventory=inventory),
+                        [dac_data[i] for i in stale])
+    records = []
+    built = dict(zip(stale, built))
+    cache = {}
+    for i, dac_record in enumerate(dac_data):
+        if i in built:
+            record = built[i]
+            cached_at = time.time()
         else:
-            for key in ('nc_files_count', 'latest_nc_file',
-                        'nc_file_last_update'):
-                meta[key] = None
-
-        logger.info('Fetching THREDDS catalog: %s', tds_das_url)
-        tds_request = requests.get(tds_das_url)
-        meta['tds'] = None
-        if tds_request.status_code == 200:
-            meta['tds'] = tds_das_url.replace('.das', '.html')
-        # Add the deployment metadata to the return object
-        deployments['datasets'].append(collections.OrderedDict(
-            sorted(list(meta.items()), key=lambda t: t[0])))
-
+            record = previous[dac_record['id']]['record']
+            cached_at = previous[dac_record['id']]['cached_at']
+        if record is None:
+            continue
+        records.append(record)
+        cache[dac_record['id']] = {
+            'fingerprint': fingerprints[i],
+            'cached_at': cached_at,
+            'record': record
+        }
+    deployments['datasets'] = records
+
+    logger.info('Built %d deployment records (%d reused) in %.1f s with %d '
+                'fetches', len(records), len(dac_data) - len(stale),
+                time.time() - start_time, fetcher.fetch_count)
+    logger.info('Scanned %d deployment directories', inventory.scans)
+    http_client.get_client().log_metrics(logger)
+    inventory.save()
+    write_status_cache(cache)
     status = write_json(deployments)
     return status
+
+
+def get_deployment_status(dac_record, catalog, fetcher, file_dir, inventory):
+    '''
+    Returns the status record for a single DAC deployment, or None if one of
+    the ERDDAP requests for the deployment failed
+
+    :param dict dac_record: Deployment metadata from the DAC API
+    :param ErddapCatalog catalog: The ERDDAP allDatasets snapshot
+    :param FetchPool fetcher: Pool used to make the HTTP requests
+    :param str file_dir: Root directory of the deployment NetCDF files
+    :param FileInventory inventory: Cached inventory of the NetCDF files
+    '''
+    columns = list(ERDDAP_VARIABLES.keys())
+
+    # Initialize the metadata record
+    meta = {ERDDAP_VARIABLES[column]: None for column in columns}
+
+    # Initialize a few other keys
+    meta['status'] = None
+    meta['wmo_id'] = None
+    meta['num_profiles'] = 0
+    meta['ts0'] = None
+    meta['ts1'] = None
+    meta['start'] = None
+    meta['end'] = None
+
+    # Create and add the dac2.0 deployment url
+    meta['dac_url'] = DEPLOYMENT_URL_TEMPLATE.format(dac_record['id'])
+
+    # If the dac deployment name is in the ERDDAP catalog, make an ERDDAP
+    # request and fill in the missing metadata
+    if dac_record['name'] in catalog:
+        record = catalog.record(dac_record['name'], columns)
+        for column in columns:
+            meta[ERDDAP_VARIABLES[column]] = record[column]
+
+        dataset_id = record['datasetID']
+
+        # Take the time coverage from the allDatasets minTime/maxTime and only
+        # request the ERDDAP Data Attribute Structure (.das) document when the
+        # catalog is missing one of them
+        t0 = get_catalog_time(meta['ts0'])
+        t1 = get_catalog_time(meta['ts1'])
+        if t0 is None or t1 is None:
+            das_url = '.'.join([record['tabledap'], 'das'])
+            coverage = get_das_time_coverage(das_url, dataset_id, fetcher)
+            if coverage is None:
+                return None
+            t0 = t0 or coverage[0]
+            t1 = t1 or coverage[1]
+
+        # Add the time coverages
+        # badams: if a start or end time regex fails to match, don't try to
+        # access attributes
+        if t0 is not None:
+            meta['ts0'] = t0
+            meta['start'] = clock.erddap_ts2epoch(t0) * 1000
+        if t1 is not None:
+            meta['ts1'] = t1
+            meta['end'] = clock.erddap_ts2epoch(t1) * 1000
+
+        if dataset_id.find('all') == -1 and dataset_id.find('development') == -1:
+            summary = get_profile_summary(meta['tabledap'], fetcher.get)
+            if summary is None:
+                return None
+            meta['wmo_id'], meta['num_profiles'] = summary
+
+    for name in list(dac_record.keys()):
+        meta[name] = dac_record[name]
+
+    # Try to fetch the THREDDS .das to see if the dataset exists
+    tds_das_url = TDS_URL_TEMPLATE.format(meta['username'],
+                                          meta['name'],
+                                          meta['username'],
+                                          meta['name'],
+                                          meta['name'])
+    meta['potential_invalid_files'] = []
+    if file_dir is not None:
+        deployment_loc = os.path.join(file_dir, meta['deployment_dir'])
+        logger.info('Fetching DAC raw files from {}'.format(deployment_loc))
+        # count of all the netCDF files in the particular directory and the
+        # most recently modified one
+        nc_files = inventory.get(deployment_loc)
+        meta['nc_files_count'] = nc_files['count']
+        meta['latest_nc_file'] = nc_files['latest']
+        # if empty, set the netCDF files to None
+        meta['nc_file_last_update'] = None
+        if nc_files['latest'] is not None:
+            meta['nc_file_last_update'] = int(nc_files['latest_mtime'] * 1000)
+    # if the file_dir variable is None, just leave the keys empty
+    else:
+        for key in ('nc_files_count', 'latest_nc_file',
+                    'nc_file_last_update'):
+            meta[key] = None
+
+    logger.info('Fetching THREDDS catalog: %s', tds_das_url)
+    tds_request = fetcher.get(tds_das_url)
+    meta['tds'] = None
+    if tds_request.status_code == 200:
+        meta['tds'] = tds_das_url.replace('.das', '.html')
+    # Add the deployment metadata to the return object
+    return collections.OrderedDict(sorted(list(meta.items()), key=lambda t: t[0]))
+
+
+def get_catalog_time(value):
+    '''
+    Returns an allDatasets minTime/maxTime value as an ERDDAP ISO 8601 string,
+    or None if the catalog doesn't have a usable value
+
+    :param value: ISO 8601 string or seconds since 1970
+    '''
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return clock.erddap_epoch2ts(value)
+    if ISO_TIME_RE.match(value) is None:
+        return None
+    return value
+
+
+def get_das_time_coverage(das_url, dataset_id, fetcher):
+    '''
+    Returns a tuple of the time_coverage_start and time_coverage_end global
+    attributes from the dataset's .das document, either of which is None if
+    it's missing. Returns None if the request fails.
+
+    :param str das_url: URL of the ERDDAP .das document
+    :param str dataset_id: ERDDAP datasetID
+    :param FetchPool fetcher: Pool used to make the HTTP requests
+    '''
+    logger.info('Fetching das: %s', das_url)
+    das_request = fetcher.get(das_url, timeout=60)
+    if das_request.status_code != 200:
+        logger.error('das request failed: %s (%s)',
+                     das_url, das_request.reason)
+        return None
+
+    # Parse the global:time_coverage_start attribute
+    t0_match = T0_RE.search(das_request.text)
+    if not t0_match:
+        logger.error('%s: No time_coverage_start regex match', dataset_id)
+
+    # Parse the global:time_coverage_end attribute
+    t1_match = T1_RE.search(das_request.text)
+    if not t1_match:
+        logger.error('%s: No time_coverage_end regex match', dataset_id)
+
+    return (t0_match.groups()[0] if t0_match else None,
+            t1_match.groups()[0] if t1_match else None)
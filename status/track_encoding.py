@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+'''
+status.track_encoding
+
+Compact encodings of trajectory coordinates. Coordinates are quantized to
+fixed point (1e-5 degrees by default, about a metre) and delta encoded.
+
+polyline
+    The Google encoded polyline algorithm. Pairs are encoded in latitude,
+    longitude order as the format requires and are decoded back to
+    longitude, latitude.
+
+binary
+    A little-endian header followed by the zigzag LEB128 varint deltas of the
+    longitude, latitude pairs, the first pair relative to zero::
+
+        b'GTRK' | version uint8 | precision uint8 | count uint32 | deltas
+'''
+
+import numpy as np
+import struct
+
+MAGIC = b'GTRK'
+VERSION = 1
+HEADER = struct.Struct('<4sBBI')
+
+
+def quantize(coordinates, precision=5):
+    '''
+    Returns the (n, 2) int64 fixed-point deltas of lon, lat coordinates
+
+    :param coordinates: Sequence of (lon, lat) pairs
+    :param int precision: Number of decimal places kept
+    '''
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    fixed = np.round(coordinates * 10 ** precision).astype(np.int64)
+    return np.diff(fixed, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+
+def dequantize(deltas, precision=5):
+    '''
+    Returns the coordinates of fixed-point deltas as a list of (lon, lat)
+
+    :param numpy.ndarray deltas: (n, 2) integer deltas
+    :param int precision: Number of decimal places kept
+    '''
+    fixed = np.cumsum(np.asarray(deltas, dtype=np.int64).reshape(-1, 2), axis=0)
+    return [tuple(pair) for pair in (fixed / 10 ** precision).tolist()]
+
+
+def encode_polyline(coordinates, precision=5):
+    '''
+    Returns lon, lat coordinates as an encoded polyline string
+
+    :param coordinates: Sequence of (lon, lat) pairs
+    :param int precision: Number of decimal places kept
+    '''
+    chunks = []
+    for value in quantize(coordinates, precision)[:, ::-1].ravel().tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def decode_polyline(polyline, precision=5):
+    '''
+    Returns the list of (lon, lat) coordinates of an encoded polyline
+
+    :param str polyline: Encoded polyline
+    :param int precision: Number of decimal places kept
+    '''
+    values = []
+    value = shift = 0
+    for char in polyline:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return dequantize(np.array(values).reshape(-1, 2)[:, ::-1], precision)
+
+
+def encode_binary(coordinates, precision=5):
+    '''
+    Returns lon, lat coordinates in the binary container
+
+    :param coordinates: Sequence of (lon, lat) pairs
+    :param int precision: Number of decimal places kept
+    '''
+    deltas = quantize(coordinates, precision)
+    data = bytearray(HEADER.pack(MAGIC, VERSION, precision, len(deltas)))
+    for value in deltas.ravel().tolist():
+        value = (value << 1) ^ (value >> 63)
+        while value >= 0x80:
+            data.append(0x80 | (value & 0x7f))
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def decode_binary(data):
+    '''
+    Returns the list of (lon, lat) coordinates in a binary container
+
+    :param bytes data: Output of encode_binary
+    '''
+    magic, version, precision, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version {} track container'.format(VERSION))
+    values = []
+    value = shift = 0
+    for byte in data[HEADER.size:]:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value = shift = 0
+    if len(values) != 2 * count:
+        raise ValueError('Truncated track container')
+    return dequantize(np.array(values).reshape(-1, 2), precision)
@@ -1,167 +1,449 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
-import requests
+import math
 import sys
 from app import app
 from shapely.geometry import LineString
-import shapely.geometry as sgeom
 from status.profile_plots import iter_deployments, is_recent_data, is_recent_update
+from status import http_client
+from status.land_mask import get_land_mask
+from status.erddap import ErddapCatalog, read_csv_columns
+from status import track_encoding
+from status.publish import set_default_mode
 from requests.exceptions import RequestException
 import numpy as np
 from datetime import datetime
-
+import status.clocks as clock
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
-os.environ["CARTOPY_USER_BACKGROUNDS"] = "/tmp/cartopy"
-os.environ["CARTOPY_DATA_DIR"] = "/tmp/cartopy"
+import tempfile
+import time
+
+# Simplification tolerances in degrees of the trajectory levels of detail.
+# The DEFAULT_TOLERANCE level is also written to <name>.json.
+DEFAULT_TOLERANCE = 0.02
+DEFAULT_TOLERANCES = (0.1, 0.02, 0.002)
+# Zoom levels beyond this are treated as this one
+MAX_ZOOM = 24
+
+# File suffix and mimetype of each trajectory encoding
+FORMATS = {
+    'geojson': ('.json', 'application/json'),
+    'polyline': ('.polyline.json', 'application/json'),
+    'binary': ('.trk', 'application/octet-stream'),
+}
 
-import cartopy.io.shapereader as shpreader
 
+def get_tolerances():
+    '''
+    Returns the configured TRAJECTORY_TOLERANCES, coarsest first, always
+    including DEFAULT_TOLERANCE
+    '''
+    tolerances = app.config.get('TRAJECTORY_TOLERANCES') or DEFAULT_TOLERANCES
+    return sorted(set(tolerances) | {DEFAULT_TOLERANCE}, reverse=True)
 
-# Load higher-resolution land polygons for better accuracy
-land_shp = shpreader.natural_earth(resolution='10m', category='physical', name='land')
-land_geom = list(shpreader.Reader(land_shp).geometries())
 
-def get_trajectory(erddap_url):
+def select_tolerance(zoom=None, tolerance=None):
     '''
-    Reads the trajectory information from ERDDAP and returns a GEOJSON-like
-    structure. Filters by min_time from deployment date.
+    Returns the coarsest level of detail that is no coarser than the requested
+    tolerance, or than one pixel at a web map zoom level. Returns
+    DEFAULT_TOLERANCE if neither is given. Raises ValueError for a
+    tolerance that isn't positive or a zoom that isn't finite.
+
+    :param float zoom: Web map zoom level, 256 pixel tiles, clamped to
+                       0-MAX_ZOOM
+    :param float tolerance: Tolerance in degrees
+    '''
+    if tolerance is None and zoom is None:
+        return DEFAULT_TOLERANCE
+    if tolerance is not None and not tolerance > 0:
+        raise ValueError('tolerance must be positive')
+    if tolerance is None:
+        if not math.isfinite(zoom):
+            raise ValueError('zoom must be a number')
+        zoom = min(max(zoom, 0), MAX_ZOOM)
+        tolerance = 360.0 / (256 * 2 ** zoom)
+    tolerances = get_tolerances()
+    for level in tolerances:
+        if level <= tolerance:
+            return level
+    return tolerances[-1]
+
+
+def fetch_track(erddap_url, since=None):
+    '''
+    Reads the longitude, latitude, time and location flag columns of a
+    dataset from ERDDAP, ordered by time, and returns them as a GeoJSON-like
+    structure of NumPy columns. The CSV response is streamed into the
+    columns so the table is never held as JSON or Python lists.
+
+    :param str erddap_url: ERDDAP dataset URL
+    :param str since: Only read rows with a time after this ERDDAP timestamp
     '''
     # Example URL:
     # https://gliders.ioos.us/erddap/tabledap/ru01-20140104T1621.json?latitude,longitude&time&orderBy(%22time%22)
 
-    # get deployment time (e.g., 20250611T0000)
-    min_time = erddap_url.split("/")[-1].replace(".html", "").split("-")[-1]
-
-    # fix url with json extension
-    url = erddap_url.replace("html", "json")
+    # fix url with csv extension
+    url = erddap_url.replace("html", "csv")
+    time_filter = f"&time%3E{since}" if since else ""
 
     # ERDDAP requires the variable being sorted to be present in the variable
     # list. The time variable will be removed before converting to GeoJSON
 
-    valid_response = False
+    response = None
     for qc_append in ("qartod_location_test_flag,", ""):
-        url_append = url + f"?longitude,latitude,{qc_append}time&orderBy(%22time%22)"
+        url_append = url + f"?longitude,latitude,{qc_append}time{time_filter}&orderBy(%22time%22)"
         try:
-            response = requests.get(url_append, timeout=180, allow_redirects=True)
+            response = http_client.get(url_append, timeout=180, stream=True)
+            if since and response.status_code == 404 and "no matching results" in response.text:
+                # Nothing new since the last update
+                return empty_track()
             response.raise_for_status()
         except RequestException as e:
             print(e)
+            error = e
             continue
         else:
-            valid_response = True
             break
-
-    if not valid_response:
+    else:
         app.logger.error(f"Failed to fetch trajectories: {url_append}")
+        raise error
 
-    data = response.json()
+    dtypes = {"longitude": float, "latitude": float, "time": "datetime64[s]"}
+    if qc_append:
+        dtypes["qartod_location_test_flag"] = float
+    columns = read_csv_columns(response, dtypes)
 
-    # Map rows into lon/lat/time/flag
-    col_names = data["table"]["columnNames"]
-    rows = data["table"]["rows"]
+    return {
+        "type": "LineString",
+        "coordinates": np.column_stack([columns["longitude"], columns["latitude"]]),
+        "time": columns["time"],
+        "flag": columns.get("qartod_location_test_flag"),
+    }
 
-    # Identify column indices dynamically
-    lon_idx = col_names.index("longitude")
-    lat_idx = col_names.index("latitude")
-    time_idx = col_names.index("time")
-    flag_idx = col_names.index("qartod_location_test_flag") if "qartod_location_test_flag" in col_names else None
 
-    geo_data = {
+def empty_track():
+    '''
+    Returns a fetch_track structure without any rows
+    '''
+    return {
         "type": "LineString",
-        "coordinates": [(r[lon_idx], r[lat_idx]) for r in rows],
-        "time": [r[time_idx] for r in rows],
-        "flag": [r[flag_idx] for r in rows] if flag_idx is not None else None,
+        "coordinates": np.empty((0, 2)),
+        "time": np.empty(0, dtype="datetime64[s]"),
+        "flag": None,
     }
 
-    # Call your parse function with min_time filter
-    geometry = parse_geometry_with_checks(geo_data, geo_data["flag"] is not None, min_time)
 
-    # Simplify trajectory
-    coords = LineString(geometry["coordinates"])
-    trajectory = coords.simplify(0.02, preserve_topology=False)
+def get_min_time(erddap_url):
+    '''
+    Returns the deployment time in a dataset URL, e.g. 20250611T0000
+    '''
+    return erddap_url.split("/")[-1].replace(".html", "").split("-")[-1]
 
-    geometry = {
-        "type": "LineString",
-        "coordinates": list(trajectory.coords),
-        "properties": {
-            "oceansmap_type": "glider",
+
+def simplify_levels(coordinates, tolerances):
+    '''
+    Returns a dictionary of tolerance to the simplified GeoJSON-like
+    trajectory of cleaned coordinates
+
+    :param numpy.ndarray coordinates: (n, 2) array of longitude, latitude
+    :param list tolerances: Simplification tolerances in degrees
+    '''
+    coords = LineString(coordinates)
+    levels = {}
+    for tolerance in tolerances:
+        trajectory = coords.simplify(tolerance, preserve_topology=False)
+        levels[tolerance] = {
+            "type": "LineString",
+            "coordinates": list(trajectory.coords),
+            "properties": {
+                "oceansmap_type": "glider",
+            }
         }
-    }
-    return geometry
+    return levels
+
+
+def update_trajectory(deployment, catalog=None, rebuild=False):
+    '''
+    Appends the rows ERDDAP has received since the last update to the stored
+    cleaned track of a deployment and returns a dictionary of tolerance to
+    simplified trajectory for every level of detail.
+
+    The whole track is rebuilt when rebuild is set, when there is no stored
+    track or when the dataset's minTime has changed. The request is skipped
+    entirely if the dataset's maxTime hasn't changed.
+
+    :param dict deployment: Dictionary containing the deployment metadata
+    :param ErddapCatalog catalog: ERDDAP allDatasets snapshot providing
+                                  minTime and maxTime, if available
+    :param bool rebuild: Rebuild the track from scratch
+    '''
+    track, geo_data = fetch_update(deployment, catalog, rebuild)
+    return apply_update(deployment, track, geo_data)
+
+
+def fetch_update(deployment, catalog=None, rebuild=False):
+    '''
+    The I/O half of update_trajectory. Returns the stored track and the
+    ERDDAP rows it is missing, or None for the rows if the dataset hasn't
+    changed.
+
+    :param dict deployment: Dictionary containing the deployment metadata
+    :param ErddapCatalog catalog: ERDDAP allDatasets snapshot, if available
+    :param bool rebuild: Rebuild the track from scratch
+    '''
+    dataset_min_time = dataset_max_time = None
+    if catalog is not None:
+        dataset_min_time = catalog.get(deployment['name'], 'minTime')
+        dataset_max_time = catalog.get(deployment['name'], 'maxTime')
+
+    track_path = get_track_path(deployment)
+    track = None if rebuild else load_track(track_path)
+    if (track is not None and dataset_min_time is not None and
+            track['dataset_min_time'] != dataset_min_time):
+        track = None
+    if track is None:
+        track = {
+            'coordinates': np.empty((0, 2)),
+            'watermark': None,
+            'dataset_min_time': dataset_min_time,
+            'dataset_max_time': None,
+        }
+
+    if dataset_max_time is not None and dataset_max_time == track['dataset_max_time']:
+        return track, None
+    geo_data = fetch_track(deployment['erddap'], since=track['watermark'])
+    track['dataset_min_time'] = dataset_min_time
+    track['dataset_max_time'] = dataset_max_time
+    return track, geo_data
 
 
-def get_path(deployment):
+def apply_update(deployment, track, geo_data):
+    '''
+    The CPU half of update_trajectory. Cleans and appends the new rows,
+    saves the track and returns the simplified levels of detail.
+
+    :param dict deployment: Dictionary containing the deployment metadata
+    :param dict track: Stored track returned by fetch_update
+    :param dict geo_data: New rows returned by fetch_update, or None
+    '''
+    if geo_data is not None:
+        geometry = parse_geometry_with_checks(geo_data, geo_data["flag"] is not None,
+                                              get_min_time(deployment['erddap']))
+        track['coordinates'] = np.concatenate([track['coordinates'],
+                                               geometry['coordinates']])
+        times = geo_data['time'][~np.isnat(geo_data['time'])]
+        if len(times):
+            track['watermark'] = np.datetime_as_string(times[-1], unit='s') + 'Z'
+        save_track(get_track_path(deployment), track)
+
+    return simplify_levels(track['coordinates'], get_tolerances())
+
+
+def get_formats():
+    '''
+    Returns the configured TRAJECTORY_FORMATS
+    '''
+    return app.config.get('TRAJECTORY_FORMATS') or ['geojson']
+
+
+def get_relative_path(username, name, tolerance=None, fmt='geojson'):
+    '''
+    Returns the path of a trajectory file relative to TRAJECTORY_DIR
+
+    :param str username: Deployment username
+    :param str name: Deployment name
+    :param float tolerance: Level of detail, defaults to DEFAULT_TOLERANCE
+    :param str fmt: One of FORMATS
+    '''
+    suffix = FORMATS[fmt][0]
+    if tolerance is None or tolerance == DEFAULT_TOLERANCE:
+        return '{}/{}{}'.format(username, name, suffix)
+    return '{}/{}.tol{:g}{}'.format(username, name, tolerance, suffix)
+
+
+def get_path(deployment, tolerance=None, fmt='geojson'):
     '''
     Returns the path to the trajectory file
 
     :param dict deployment: Dictionary containing the deployment metadata
+    :param float tolerance: Level of detail, defaults to DEFAULT_TOLERANCE
+    :param str fmt: One of FORMATS
     '''
     trajectory_dir = app.config.get('TRAJECTORY_DIR')
     username = deployment['username']
-    name = deployment['name']
     dir_path = os.path.join(trajectory_dir, username)
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-    file_path = os.path.join(dir_path, name + '.json')
-    return file_path
+    os.makedirs(dir_path, exist_ok=True)
+    return os.path.join(trajectory_dir, get_relative_path(
+        username, deployment['name'], tolerance, fmt))
 
 
-def write_trajectory(deployment, geo_data):
+def encode_trajectory(geo_data, fmt):
     '''
-    Writes a geojson like python structure to the appropriate data file
+    Returns the bytes of a GeoJSON-like trajectory in one of FORMATS
+
+    :param dict geo_data: A GeoJSON Geometry object
+    :param str fmt: One of FORMATS
+    '''
+    precision = app.config.get('TRAJECTORY_PRECISION', 5)
+    if fmt == 'binary':
+        return track_encoding.encode_binary(geo_data['coordinates'], precision)
+    if fmt == 'polyline':
+        geo_data = dict(geo_data,
+                        coordinates=track_encoding.encode_polyline(
+                            geo_data['coordinates'], precision),
+                        encoding='polyline',
+                        precision=precision)
+    return json.dumps(geo_data).encode('utf-8')
+
+
+def write_trajectory(deployment, geo_data, tolerance=None, formats=None):
+    '''
+    Writes a geojson like python structure to the appropriate data files
 
     :param dict deployment: Dictionary containing the deployment metadata
     :param dict geometry: A GeoJSON Geometry object
+    :param float tolerance: Level of detail of the geometry
+    :param list formats: Encodings written, defaults to TRAJECTORY_FORMATS
     '''
-    file_path = get_path(deployment)
-    with open(file_path, 'w') as f:
-        f.write(json.dumps(geo_data))
+    for fmt in formats or get_formats():
+        file_path = get_path(deployment, tolerance, fmt)
+        # Written atomically because the API serves these files directly
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encode_trajectory(geo_data, fmt))
+        set_default_mode(tmp_path)
+        os.replace(tmp_path, file_path)
+
+
+def build_trajectory(deployment, catalog=None, rebuild=False):
+    '''
+    Updates the stored track of a deployment and writes every level of
+    detail of its trajectory
+
+    :param dict deployment: Dictionary containing the deployment metadata
+    :param ErddapCatalog catalog: ERDDAP allDatasets snapshot, if available
+    :param bool rebuild: Rebuild the track from scratch
+    '''
+    levels = update_trajectory(deployment, catalog, rebuild)
+    for tolerance, geo_data in levels.items():
+        write_trajectory(deployment, geo_data, tolerance)
+
+
+def process_trajectory(deployment, track, geo_data):
+    '''
+    Runs apply_update and writes every level of detail, returning the time
+    taken. Runs in the CPU pool of generate_trajectories.
+    '''
+    start = time.time()
+    levels = apply_update(deployment, track, geo_data)
+    for tolerance, trajectory in levels.items():
+        write_trajectory(deployment, trajectory, tolerance)
+    return time.time() - start
+
+
+def configured_land_mask(mode=None):
+    '''
+    Returns the land mask selected by the LAND_MASK configuration
 
+    :param str mode: 'exact' or 'raster', defaults to LAND_MASK.MODE
+    '''
+    config = app.config.get('LAND_MASK') or {}
+    return get_land_mask(mode or config.get('MODE', 'exact'),
+                         config.get('CACHE_DIR'),
+                         config.get('RESOLUTION', 0.1))
+
+
+def get_track_path(deployment):
+    '''
+    Returns the path to the stored full resolution track used for
+    incremental updates
 
-def parse_geometry_with_checks(geometry: dict, has_flag: bool, min_time: str = None):
+    :param dict deployment: Dictionary containing the deployment metadata
+    '''
+    return os.path.splitext(get_path(deployment))[0] + '.npz'
+
+
+def load_track(track_path):
+    '''
+    Returns the stored track written by save_track or None
+
+    :param str track_path: Path of the .npz track
+    '''
+    try:
+        with np.load(track_path, allow_pickle=False) as data:
+            return {
+                'coordinates': data['coordinates'],
+                'watermark': str(data['watermark']) or None,
+                'dataset_min_time': str(data['dataset_min_time']) or None,
+                'dataset_max_time': str(data['dataset_max_time']) or None,
+            }
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def save_track(track_path, track):
+    '''
+    Atomically writes the cleaned coordinates of a track and its watermarks
+
+    :param str track_path: Path of the .npz track
+    :param dict track: Track with coordinates, watermark, dataset_min_time
+                       and dataset_max_time
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(track_path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, coordinates=track['coordinates'],
+                 watermark=track['watermark'] or '',
+                 dataset_min_time=track['dataset_min_time'] or '',
+                 dataset_max_time=track['dataset_max_time'] or '')
+    os.replace(tmp_path, track_path)
+
+
+def parse_geometry_with_checks(geometry: dict, has_flag: bool, min_time: str = None,
+                               land_mask_mode: str = None):
     """
     Filters out bad coordinate pairs based on:
       - minimum time threshold (if provided),
       - flags,
-      - land masking,
+      - land masking ('exact' polygons or the 'raster' lookup table),
       - outlier detection.
-    
-    Returns geometry with only 'coordinates'.
+
+    The checks are combined into one boolean mask over NumPy arrays. The
+    coordinates, time and flag sequences must be aligned; None marks a
+    missing value.
+
+    Returns geometry with only 'coordinates', an (n, 2) float array.
     """
-    
-    coords = []
+    lonlat = np.asarray(geometry['coordinates'], dtype=float).reshape(-1, 2)
     times = geometry.get("time")
 
-    # --- Step 0: Time filtering ---
-    if min_time and times:
-        min_dt = datetime.strptime(min_time, "%Y%m%dT%H%M")
-        filtered = [((lon, lat), t) for (lon, lat), t in zip(geometry['coordinates'], times)
-                    if datetime.strptime(t, "%Y-%m-%dT%H:%M:%SZ") >= min_dt]
-        filtered_coords = [lonlat for lonlat, _ in filtered]
-    else:
-        filtered_coords = geometry['coordinates']
+    # --- Step 0: Missing values ---
+    keep = np.isfinite(lonlat).all(axis=1)
+
+    # --- Step 1: Time filtering ---
+    if min_time and times is not None and len(times):
+        min_dt = np.datetime64(datetime.strptime(min_time, "%Y%m%dT%H%M"), 's')
+        keep &= clock.erddap_ts2datetime64(times) >= min_dt
 
-    # --- Step 1: Filter by flags and missing values ---
+    # --- Step 2: Flags, a missing flag passes ---
     if has_flag:
-        filtered_coords = [
-            (lon, lat) for (lon, lat), flag in zip(filtered_coords, geometry['flag'])
-            if (flag is None or flag == 1) and lon is not None and lat is not None
-        ]
-    else:
-        filtered_coords = [(lon, lat) for lon, lat in filtered_coords
-                           if lon is not None and lat is not None]
- 
-    # --- Step 2: Remove points that fall on land ---
-    sea_coords = [(lon, lat) for lon, lat in filtered_coords if not is_on_land(lon, lat)]
-    
-    return {'coordinates': sea_coords}
+        flags = np.asarray(geometry['flag'], dtype=float)
+        keep &= np.isnan(flags) | (flags == 1)
+
+    # --- Step 3: Remove points that fall on land ---
+    candidates = np.flatnonzero(keep)
+    on_land = configured_land_mask(land_mask_mode).contains(
+        lonlat[candidates, 0], lonlat[candidates, 1])
+    keep[candidates[on_land]] = False
+
+    return {'coordinates': lonlat[keep]}
 
 
 def is_on_land(lon, lat):
     """Check if coordinate is on land using shapely polygons."""
-    point = sgeom.Point(lon, lat)
-    return any(poly.contains(point) for poly in land_geom)
+    return bool(configured_land_mask().contains(lon, lat))
 
 
 def trajectory_exists(deployment):
@@ -175,10 +457,37 @@ def trajectory_exists(deployment):
     return os.path.exists(file_path)
 
 
-def generate_trajectories(deployments=None):
+def _timed_fetch(deployment, catalog, rebuild):
+    start = time.time()
+    track, geo_data = fetch_update(deployment, catalog, rebuild)
+    return track, geo_data, time.time() - start
+
+
+def _cpu_pool(workers):
+    '''
+    Returns a process pool, or a thread pool in daemonic processes such as
+    Celery prefork workers, which aren't allowed to have children. The
+    processes are started by a forkserver, so none of them is forked from
+    this process once the fetch threads are running.
+    '''
+    if (workers <= 1 or multiprocessing.current_process().daemon or
+            'forkserver' not in multiprocessing.get_all_start_methods()):
+        return ThreadPoolExecutor(max(workers, 1))
+    context = multiprocessing.get_context('forkserver')
+    # app first, as the status package can only be imported after it
+    context.set_forkserver_preload(['app', 'status.trajectories'])
+    return ProcessPoolExecutor(workers, mp_context=context)
+
+
+def select_trajectories(deployments=None):
     '''
-    Determine which trajectories need to be built, and write geojson to file
+    Returns the deployments whose trajectories should be built and a summary
+    counting the ones skipped or failed while choosing them
+
+    :param list deployments: Deployment names to consider, default all
     '''
+    summary = {'updated': 0, 'failed': 0, 'skipped': 0, 'deployments': []}
+    selected = []
     # TODO: Use a less brute force approach to filtering
     for deployment in iter_deployments():
         if deployments is not None and deployment["name"] not in deployments:
@@ -191,12 +500,135 @@ def generate_trajectories(deployments=None):
             if (not deployment["name"].endswith("-delayed") and
                 (recent_update or recent_data or not existing_trajectory
                 or not deployment["completed"])):
-                geo_data = get_trajectory(deployment['erddap'])
-                write_trajectory(deployment, geo_data)
-        except Exception:
-            from traceback import print_exc
-            print_exc()
-    return 0
+                selected.append(deployment)
+            else:
+                summary['skipped'] += 1
+        except Exception as e:
+            add_result(summary, failed_result(deployment, e))
+    return selected, summary
+
+
+def failed_result(deployment, error, **timing):
+    '''
+    Logs a failed trajectory build and returns its summary entry
+    '''
+    app.logger.error('Failed to build the trajectory of %s',
+                     deployment['name'], exc_info=error)
+    return dict(timing, name=deployment['name'], status='failed',
+                error=repr(error))
+
+
+def add_result(summary, result):
+    '''
+    Counts the summary entry of one deployment in a trajectory summary
+    '''
+    summary[result['status']] += 1
+    summary['deployments'].append(result)
+
+
+def finish_summary(summary, start_time):
+    '''
+    Sorts and times a trajectory summary and logs it
+    '''
+    summary['deployments'].sort(key=lambda d: d['name'])
+    summary['seconds'] = time.time() - start_time
+    app.logger.info('Trajectories: %d updated, %d failed, %d skipped in %.1f s',
+                    summary['updated'], summary['failed'], summary['skipped'],
+                    summary['seconds'])
+    return summary
+
+
+def get_time_extents(deployment, catalog):
+    '''
+    Returns the (minTime, maxTime) of a deployment in an ERDDAP catalog
+    '''
+    if catalog is None:
+        return None, None
+    return (catalog.get(deployment['name'], 'minTime'),
+            catalog.get(deployment['name'], 'maxTime'))
+
+
+def build_deployment_trajectory(deployment, time_extents=None, rebuild=False):
+    '''
+    Updates and writes the trajectory of one deployment and returns its
+    summary entry. Used by the per-deployment Celery subtasks.
+
+    :param dict deployment: Dictionary containing the deployment metadata
+    :param tuple time_extents: The dataset's (minTime, maxTime) in ERDDAP
+    :param bool rebuild: Rebuild the track from scratch
+    '''
+    # A one row catalog, as the full snapshot isn't sent to each subtask
+    min_time, max_time = time_extents or (None, None)
+    catalog = ErddapCatalog({'columnNames': ['datasetID', 'minTime', 'maxTime'],
+                             'rows': [[deployment['name'], min_time, max_time]]})
+    try:
+        track, geo_data, fetch_seconds = _timed_fetch(deployment, catalog, rebuild)
+    except Exception as e:
+        return failed_result(deployment, e)
+    try:
+        cpu_seconds = process_trajectory(deployment, track, geo_data)
+    except Exception as e:
+        return failed_result(deployment, e, fetch_seconds=fetch_seconds)
+    return {
+        'name': deployment['name'],
+        'status': 'updated',
+        'fetch_seconds': fetch_seconds,
+        'cpu_seconds': cpu_seconds,
+    }
+
+
+def generate_trajectories(deployments=None, rebuild=False, fetch_workers=None,
+                          cpu_workers=None):
+    '''
+    Determine which trajectories need to be built, and write geojson to file.
+
+    ERDDAP requests run on a thread pool and the cleaning, simplification
+    and writing of each track on a process pool as soon as its rows arrive.
+    Returns a summary with the outcome and timing of every deployment built.
+
+    Celery prefork workers can't start processes, so there the cleaning runs
+    on threads. The scheduled task, status.tasks.get_trajectory_features,
+    builds each deployment in its own subtask instead.
+    '''
+    config = app.config.get('TRAJECTORY_WORKERS') or {}
+    fetch_workers = fetch_workers or config.get('FETCH', 8)
+    cpu_workers = cpu_workers or config.get('CPU') or os.cpu_count() or 1
+    start_time = time.time()
+
+    # One catalog snapshot tells which tracks have new data or were reset
+    catalog = ErddapCatalog.fetch(app.config['ERDDAP_URL'])
+    selected, summary = select_trajectories(deployments)
+
+    with _cpu_pool(cpu_workers) as cpu_pool, \
+            ThreadPoolExecutor(fetch_workers) as fetch_pool:
+        fetches = {fetch_pool.submit(_timed_fetch, deployment, catalog, rebuild):
+                   deployment for deployment in selected}
+        builds = {}
+        for future in as_completed(fetches):
+            deployment = fetches[future]
+            try:
+                track, geo_data, fetch_seconds = future.result()
+            except Exception as e:
+                add_result(summary, failed_result(deployment, e))
+                continue
+            build = cpu_pool.submit(process_trajectory, deployment, track, geo_data)
+            builds[build] = (deployment, fetch_seconds)
+        for future in as_completed(builds):
+            deployment, fetch_seconds = builds[future]
+            try:
+                cpu_seconds = future.result()
+            except Exception as e:
+                add_result(summary, failed_result(deployment, e,
+                                                  fetch_seconds=fetch_seconds))
+                continue
+            add_result(summary, {
+                'name': deployment['name'],
+                'status': 'updated',
+                'fetch_seconds': fetch_seconds,
+                'cpu_seconds': cpu_seconds,
+            })
+
+    return finish_summary(summary, start_time)
 
 
 if __name__ == '__main__':
@@ -207,5 +639,11 @@ if __name__ == '__main__':
         action='append',
         help='Which deployment to build'
     )
+    parser.add_argument(
+        '-r', '--rebuild',
+        action='store_true',
+        help='Rebuild the tracks instead of appending new data'
+    )
     args = parser.parse_args()
-    sys.exit(generate_trajectories(args.deployment))
+    summary = generate_trajectories(args.deployment, args.rebuild)
+    sys.exit(1 if summary['failed'] else 0)
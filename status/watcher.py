@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''
+status.watcher
+
+Watches FILE_DIR for new or updated NetCDF files and triggers a refresh of
+only the deployments they belong to. Deployment directories are laid out as
+FILE_DIR/<username>/<deployment name>.
+
+inotify is used when the inotify_simple package is installed. inotify does
+not see changes made by other hosts on network filesystems, so the watcher
+can also poll the deployment directory mtimes instead.
+'''
+
+import logging
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+logger = logging.getLogger(__name__)
+
+
+class DeploymentWatcher(object):
+    '''
+    Collects file events per deployment directory and calls on_change once a
+    deployment has been quiet for the debounce period
+    '''
+
+    def __init__(self, file_dir, on_change, debounce=30, poll_interval=10,
+                 mode='auto'):
+        '''
+        :param str file_dir: Root directory of the deployment files
+        :param on_change: Callable taking a deployment_dir relative to
+                          file_dir, e.g. 'username/name-20200101T0000'
+        :param float debounce: Seconds without events before a deployment is
+                               refreshed
+        :param float poll_interval: Seconds between polls or inotify reads
+        :param str mode: 'inotify', 'poll' or 'auto' to use inotify when
+                         available
+        '''
+        self.file_dir = os.path.abspath(file_dir)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        if mode == 'auto':
+            mode = 'inotify' if inotify_simple is not None else 'poll'
+        if mode == 'inotify' and inotify_simple is None:
+            raise ImportError('inotify mode requires inotify_simple')
+        self.mode = mode
+        # deployment_dir: (first event time, last event time)
+        self.pending = {}
+        self._mtimes = None
+        self._inotify = None
+        self._watches = {}
+
+    def deployment_dir(self, path):
+        '''
+        Returns the deployment_dir a path belongs to, or None if it's not
+        inside a deployment directory
+
+        :param str path: Absolute path of a file or directory
+        '''
+        parts = os.path.relpath(path, self.file_dir).split(os.sep)
+        if len(parts) < 2 or parts[0] in ('.', '..'):
+            return None
+        return '/'.join(parts[:2])
+
+    def notify(self, deployment_dir, now=None):
+        '''
+        Records an event for a deployment
+
+        :param str deployment_dir: Deployment directory relative to file_dir
+        :param float now: Event time, defaults to the current time
+        '''
+        now = time.time() if now is None else now
+        first, _ = self.pending.get(deployment_dir, (now, now))
+        self.pending[deployment_dir] = (first, now)
+
+    def flush(self, now=None):
+        '''
+        Calls on_change for every deployment that has been quiet for the
+        debounce period, or has been pending for ten times as long, and
+        returns them
+
+        :param float now: Current time
+        '''
+        now = time.time() if now is None else now
+        ready = [d for d, (first, last) in self.pending.items()
+                 if now - last >= self.debounce or
+                 now - first >= 10 * self.debounce]
+        for deployment_dir in sorted(ready):
+            del self.pending[deployment_dir]
+            logger.info('Refreshing %s', deployment_dir)
+            try:
+                self.on_change(deployment_dir)
+            except Exception:
+                logger.exception('Failed to refresh %s', deployment_dir)
+        return ready
+
+    def iter_deployment_dirs(self):
+        '''
+        Yields the absolute path of every deployment directory
+        '''
+        for user in os.scandir(self.file_dir):
+            if not user.is_dir():
+                continue
+            for deployment in os.scandir(user.path):
+                if deployment.is_dir():
+                    yield deployment.path
+
+    def poll(self):
+        '''
+        Records an event for every deployment directory whose mtime changed
+        since the previous poll. The first poll only records the mtimes.
+        '''
+        first_poll = self._mtimes is None
+        mtimes = {}
+        for path in self.iter_deployment_dirs():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if not first_poll and self._mtimes.get(path) != mtimes[path]:
+                self.notify(self.deployment_dir(path))
+        self._mtimes = mtimes
+
+    def _add_watch(self, path, flags):
+        if path in self._watches.values():
+            return
+        try:
+            wd = self._inotify.add_watch(path, flags)
+        except OSError:
+            logger.exception('Unable to watch %s', path)
+            return
+        self._watches[wd] = path
+
+    def _start_inotify(self):
+        flags = inotify_simple.flags
+        self._inotify = inotify_simple.INotify()
+        self._dir_flags = flags.CREATE | flags.MOVED_TO | flags.ONLYDIR
+        self._file_flags = (flags.CLOSE_WRITE | flags.MOVED_TO |
+                            flags.DELETE | flags.CREATE)
+        self._add_watch(self.file_dir, self._dir_flags)
+        for user in os.scandir(self.file_dir):
+            if user.is_dir():
+                self._add_watch(user.path, self._dir_flags)
+        for path in self.iter_deployment_dirs():
+            self._add_watch(path, self._file_flags)
+
+    def read_inotify(self):
+        '''
+        Reads the pending inotify events, watching newly created user and
+        deployment directories and recording NetCDF file events
+        '''
+        flags = inotify_simple.flags
+        for event in self._inotify.read(timeout=self.poll_interval * 1000):
+            if event.mask & flags.IGNORED:
+                # The watched directory was removed
+                self._watches.pop(event.wd, None)
+                continue
+            parent = self._watches.get(event.wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, event.name)
+            depth = len(os.path.relpath(path, self.file_dir).split(os.sep))
+            if event.mask & flags.ISDIR and depth == 1:
+                self._add_watch(path, self._dir_flags)
+            elif event.mask & flags.ISDIR and depth == 2:
+                self._add_watch(path, self._file_flags)
+                self.notify(self.deployment_dir(path))
+            elif depth == 3 and event.name.endswith('.nc'):
+                self.notify(self.deployment_dir(path))
+
+    def run(self):
+        '''
+        Watches for changes until interrupted
+        '''
+        logger.info('Watching %s using %s', self.file_dir, self.mode)
+        if self.mode == 'inotify':
+            self._start_inotify()
+        while True:
+            if self.mode == 'inotify':
+                self.read_inotify()
+            else:
+                self.poll()
+                time.sleep(self.poll_interval)
+            self.flush()
@@ -3,6 +3,7 @@ from app import app
 from flask import jsonify, Flask
 from datetime import datetime, timezone, timedelta
 import json
+import os
 from contextlib import contextmanager
 
 @app.route('/api/deployments')
@@ -87,3 +88,664 @@ def _generate_status_json(data_type="api_return"):
 
 
     return status_dict
+
+
+def test_fetch_pool_preserves_order():
+    from status.fetch_pool import FetchPool
+    import time
+    pool = FetchPool(max_workers=4)
+
+    def slow_square(i):
+        time.sleep(0.01 * (5 - i))
+        return i * i
+
+    assert pool.map(slow_square, range(5)) == [0, 1, 4, 9, 16]
+
+
+def test_status_cache_fingerprint(tmp_path):
+    from status.erddap import ErddapCatalog
+    from status.tasks import get_fingerprint, is_cached
+    import time
+    dac_record = {"id": "abc", "name": "test-20200101T0000Z",
+                  "updated": 1, "checksum": "c1",
+                  "deployment_dir": "user/test-20200101T0000Z"}
+    catalog = ErddapCatalog({
+        "columnNames": ["datasetID", "maxTime"],
+        "rows": [["test-20200101T0000Z", "2020-01-02T00:00:00Z"]]})
+    fingerprint = get_fingerprint(dac_record, catalog)
+    assert fingerprint == [1, "c1", "2020-01-02T00:00:00Z", None]
+    cache = {"abc": {"fingerprint": fingerprint, "cached_at": time.time(),
+                     "record": {}}}
+    assert is_cached(cache, dac_record, fingerprint)
+    assert not is_cached(cache, dac_record, [2, "c1", "2020-01-02T00:00:00Z", None])
+    assert not is_cached({}, dac_record, fingerprint)
+
+    # Adding a file to the deployment directory changes the fingerprint
+    deployment_dir = tmp_path / "user" / "test-20200101T0000Z"
+    deployment_dir.mkdir(parents=True)
+    os.utime(str(deployment_dir), (1000, 1000))
+    before = get_fingerprint(dac_record, catalog, str(tmp_path))
+    assert before[3] == 1000
+    (deployment_dir / "test_0001.nc").write_bytes(b"")
+    assert get_fingerprint(dac_record, catalog, str(tmp_path)) != before
+
+
+def test_get_catalog_time():
+    from status.tasks import get_catalog_time
+    assert get_catalog_time("2020-01-01T00:00:00Z") == "2020-01-01T00:00:00Z"
+    assert get_catalog_time(1577836800) == "2020-01-01T00:00:00Z"
+    assert get_catalog_time("") is None
+    assert get_catalog_time(None) is None
+
+
+class _FakeResponse(object):
+    raw = None
+    content = b"body"
+
+    def __init__(self, status_code, body=None, text="", content=None):
+        self.status_code = status_code
+        self.reason = "OK" if status_code == 200 else "Bad Request"
+        self._body = body
+        self.text = text
+        if content is not None:
+            self.content = content
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(self.reason)
+
+
+def _erddap_csv(column_names, rows):
+    lines = [",".join(column_names), ",".join("units" for _ in column_names)]
+    lines += [",".join("" if v is None else str(v) for v in row) for row in rows]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_profile_summary_falls_back_to_full_pull():
+    from status.erddap import get_profile_summary
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        if "orderByMax" in url:
+            return _FakeResponse(400)
+        rows = [["", 1], ["4801234", None], ["4801234", 3], ["4801234", 2]]
+        return _FakeResponse(200, content=_erddap_csv(["wmo_id", "profile_id"], rows))
+
+    summary = get_profile_summary("https://example.com/tabledap/test", get)
+    assert summary == ("4801234", 3)
+    assert len(requested) == 2
+
+
+def test_erddap_catalog_lookup():
+    from status.erddap import ErddapCatalog
+    catalog = ErddapCatalog({
+        "columnNames": ["datasetID", "minTime", "maxTime"],
+        "rows": [["a", "2020-01-01T00:00:00Z", "2020-01-02T00:00:00Z"],
+                 ["b", None, None],
+                 ["a", "2021-01-01T00:00:00Z", "2021-01-02T00:00:00Z"]]})
+    assert len(catalog) == 2
+    assert "a" in catalog and "c" not in catalog
+    assert catalog.get("a", "minTime") == "2020-01-01T00:00:00Z"
+    assert catalog.get("c", "minTime", "missing") == "missing"
+    assert catalog.record("b") == {"datasetID": "b", "minTime": None,
+                                   "maxTime": None}
+
+
+def test_http_client_metrics_per_host():
+    from status.http_client import HttpClient
+    client = HttpClient()
+    client.session.get = lambda url, **kwargs: _FakeResponse(
+        200 if "ok" in url else 503)
+    client.get("https://a.example.com/ok")
+    client.get("https://a.example.com/fail")
+    client.get("https://b.example.com/ok")
+    metrics = client.metrics
+    assert metrics["a.example.com"]["requests"] == 2
+    assert metrics["a.example.com"]["errors"] == 1
+    assert metrics["a.example.com"]["bytes"] == 8
+    assert metrics["b.example.com"]["requests"] == 1
+
+
+def test_http_client_response_cache(tmp_path):
+    from status.http_cache import ResponseCache
+    from status.http_client import HttpClient
+    import requests
+    requested = []
+
+    def session_get(url, headers=None, **kwargs):
+        requested.append(headers or {})
+        response = requests.Response()
+        response.url = url
+        if headers and headers.get("If-None-Match") == '"v1"':
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = b'{"table": {}}'
+            response.headers["ETag"] = '"v1"'
+        return response
+
+    cache = ResponseCache(str(tmp_path), [(r"\.das$", 60)])
+    client = HttpClient(cache=cache)
+    client.session.get = session_get
+    url = "https://example.com/erddap/tabledap/test.das"
+
+    assert client.get(url).content == b'{"table": {}}'
+    with client.get(url) as cached:
+        assert list(cached.iter_content(4))[0] == b'{"ta'
+    cached.close()
+    assert len(requested) == 1
+
+    # Once stale the entry is revalidated and the cached body reused
+    cache.ttls = [(cache.ttls[0][0], 0)]
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b'{"table": {}}'
+    assert requested[-1]["If-None-Match"] == '"v1"'
+    assert client.metrics["example.com"]["cache_hits"] == 1
+    assert client.metrics["example.com"]["not_modified"] == 1
+
+    # An entry evicted after it was loaded is fetched again, whether it was
+    # fresh or answered with a 304
+    entry = cache.load(url)
+    cache.load = lambda url: entry
+    for ttl in (60, 0):
+        cache.ttls = [(cache.ttls[0][0], ttl)]
+        os.remove(cache._path(url) + ".body")
+        count = len(requested)
+        assert client.get(url).content == b'{"table": {}}'
+        assert "If-None-Match" not in requested[-1]
+        assert len(requested) == count + (1 if ttl else 2)
+
+
+def test_file_inventory_rescans_on_change(tmp_path):
+    from status.inventory import FileInventory
+    import os
+    deployment_dir = tmp_path / "deployment"
+    deployment_dir.mkdir()
+    for i, name in enumerate(["a.nc", "b.nc", ".hidden.nc", "notes.txt"]):
+        path = deployment_dir / name
+        path.write_text("")
+        os.utime(path, (1000 + i, 1000 + i))
+    os.utime(deployment_dir, (1000, 1000))
+
+    inventory = FileInventory(str(tmp_path / "inventory.json"))
+    entry = inventory.get(str(deployment_dir))
+    assert entry["count"] == 2
+    assert entry["latest"] == "b.nc"
+    assert entry["latest_mtime"] == 1001
+    inventory.save()
+
+    # An unchanged directory is served from the saved inventory
+    inventory = FileInventory(str(tmp_path / "inventory.json"))
+    inventory.get(str(deployment_dir))
+    assert inventory.scans == 0
+
+    (deployment_dir / "c.nc").write_text("")
+    entry = inventory.get(str(deployment_dir))
+    assert inventory.scans == 1
+    assert entry["count"] == 3
+    assert entry["latest"] == "c.nc"
+
+
+def test_published_status_json(client, tmp_path):
+    from status.publish import publish_json
+    import gzip
+    status_json = str(tmp_path / "status.json")
+    data = _generate_status_json("written_json")
+    etag = publish_json(data, status_json)
+    with open(status_json) as f:
+        assert f.read() == json.dumps(data)
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(status_json).st_mode & 0o777 == 0o666 & ~umask
+
+    original = app.config["STATUS_JSON"]
+    app.config["STATUS_JSON"] = status_json
+    try:
+        resp = client.get("/static/json/status.json",
+                          headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(resp.data)) == data
+        assert resp.headers["ETag"] == '"{}-gzip"'.format(etag)
+
+        resp = client.get("/static/json/status.json",
+                          headers={"If-None-Match": '"{}"'.format(etag)})
+        assert resp.status_code == 304
+
+        app.config["STATUS_JSON"] = str(tmp_path / "missing.json")
+        assert client.get("/static/json/status.json").status_code == 404
+    finally:
+        app.config["STATUS_JSON"] = original
+
+
+def test_deployment_watcher_debounces_polled_changes(tmp_path):
+    from status.watcher import DeploymentWatcher
+    import os
+    deployment_dir = tmp_path / "test_user" / "test-20200101T0000Z"
+    deployment_dir.mkdir(parents=True)
+    refreshed = []
+    watcher = DeploymentWatcher(str(tmp_path), refreshed.append, debounce=30,
+                                mode="poll")
+    watcher.poll()
+    assert watcher.pending == {}
+
+    (deployment_dir / "test_20200105T0000Z.nc").write_text("")
+    os.utime(deployment_dir, (2000, 2000))
+    watcher.poll()
+    assert list(watcher.pending) == ["test_user/test-20200101T0000Z"]
+
+    first, last = watcher.pending["test_user/test-20200101T0000Z"]
+    assert watcher.flush(now=last + 10) == []
+    watcher.flush(now=last + 30)
+    assert refreshed == ["test_user/test-20200101T0000Z"]
+    assert watcher.pending == {}
+
+
+def test_land_mask_matches_polygon_loop():
+    from status.land_mask import LandMask
+    from shapely.geometry import Point, Polygon
+    import numpy as np
+    land = [Polygon([(-10, -10), (10, -10), (10, 10), (-10, 10)],
+                     [[(-5, -5), (5, -5), (5, 5), (-5, 5)]]),
+            Point(40, 40).buffer(3)]
+    lon = np.array([0.0, 7.0, 40.5, 100.0, np.nan, -10.0])
+    lat = np.array([0.0, 0.0, 40.5, 0.0, 0.0, 0.0])
+    expected = [False if np.isnan(x) else
+                any(poly.contains(Point(x, y)) for poly in land)
+                for x, y in zip(lon, lat)]
+    assert LandMask(land).contains(lon, lat).tolist() == expected
+    assert expected == [False, True, True, False, False, False]
+
+
+def test_raster_land_mask_matches_exact(tmp_path):
+    from status.land_mask import LandMask, RasterLandMask
+    from shapely.geometry import Point, Polygon
+    import numpy as np
+    exact = LandMask([Polygon([(-10, -10), (10, -10), (10, 10), (-10, 10)],
+                              [[(-5, -5), (5, -5), (5, 5), (-5, 5)]]),
+                      Point(40, 40).buffer(3)])
+    path = str(tmp_path / "land.npy")
+    RasterLandMask.build(exact, path, resolution=1.0)
+    raster = RasterLandMask(path, exact)
+    assert raster.grid.shape == (2, 180, 45)
+
+    rng = np.random.default_rng(0)
+    lon = np.concatenate([rng.uniform(-20, 50, 5000), [np.nan, 200.0]])
+    lat = np.concatenate([rng.uniform(-20, 50, 5000), [0.0, 0.0]])
+    assert (raster.contains(lon, lat) == exact.contains(lon, lat)).all()
+
+
+def test_land_geometries_wkb_cache(tmp_path, monkeypatch):
+    from status import land_mask
+    from shapely.geometry import Point
+    reads = []
+
+    def read_land_shapefile():
+        reads.append(1)
+        return [Point(0, 0).buffer(1)]
+
+    monkeypatch.setattr(land_mask, "read_land_shapefile", read_land_shapefile)
+    first = land_mask.load_land_geometries(str(tmp_path))
+    second = land_mask.load_land_geometries(str(tmp_path))
+    assert len(reads) == 1
+    assert (tmp_path / land_mask.LAND_CACHE_FILE).exists()
+    assert second[0].equals(first[0])
+
+
+def test_parse_geometry_with_checks_masks(monkeypatch):
+    from status import trajectories
+    from status.land_mask import LandMask
+    from shapely.geometry import Polygon
+    land = LandMask([Polygon([(10, 10), (20, 10), (20, 20), (10, 20)])])
+    monkeypatch.setattr(trajectories, "configured_land_mask",
+                        lambda mode=None: land)
+    geometry = {
+        "coordinates": [(0, 0), (1, 1), (2, 2), (None, 3), (15, 15), (4, 4),
+                        (5, 5)],
+        "time": ["2019-12-31T23:00:00Z", "2020-01-01T00:00:00Z",
+                 "2020-01-01T01:00:00Z", "2020-01-01T02:00:00Z",
+                 "2020-01-01T03:00:00Z", "2020-01-01T04:00:00Z", None],
+        "flag": [1, 1, 4, 1, 1, None, 1],
+    }
+    result = trajectories.parse_geometry_with_checks(geometry, True,
+                                                     "20200101T0000")
+    # Flags stay aligned with their points after the time filter
+    assert result["coordinates"].tolist() == [[1, 1], [4, 4]]
+
+
+def test_incremental_trajectory_update(tmp_path, monkeypatch):
+    from status import trajectories
+    from status.erddap import ErddapCatalog
+    from status.land_mask import LandMask
+    from shapely.geometry import Point
+    monkeypatch.setitem(app.config, "TRAJECTORY_DIR", str(tmp_path))
+    monkeypatch.setattr(trajectories, "configured_land_mask",
+                        lambda mode=None: LandMask([Point(50, 50).buffer(1)]))
+    rows = [[0.0, 0.0, 1, "2020-01-01T00:00:00Z"],
+            [1.0, 0.5, 1, "2020-01-01T01:00:00Z"],
+            [2.0, 0.0, 1, "2020-01-01T02:00:00Z"]]
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        if "time%3E2020-01-01T02:00:00Z" in url:
+            return _FakeResponse(404, text="Your query produced no matching results.")
+        new = rows[2:] if "time%3E" in url else rows[:len(requested) + 1]
+        columns = ["longitude", "latitude", "qartod_location_test_flag", "time"]
+        return _FakeResponse(200, content=_erddap_csv(columns, new))
+
+    monkeypatch.setattr(trajectories.http_client, "get", get)
+    deployment = {"username": "test_user", "name": "test-20200101T0000",
+                  "erddap": "https://example.com/erddap/tabledap/test-20200101T0000.html"}
+
+    def catalog(min_time, max_time):
+        return ErddapCatalog({"columnNames": ["datasetID", "minTime", "maxTime"],
+                              "rows": [[deployment["name"], min_time, max_time]]})
+
+    trajectories.update_trajectory(deployment, catalog("a", "b"))
+    # Unchanged maxTime, no request
+    trajectories.update_trajectory(deployment, catalog("a", "b"))
+    assert len(requested) == 1
+    geometry = trajectories.update_trajectory(deployment, catalog("a", "c"))
+    assert "time%3E2020-01-01T01:00:00Z" in requested[1]
+    assert geometry[0.02]["coordinates"] == [(0.0, 0.0), (1.0, 0.5), (2.0, 0.0)]
+    trajectories.update_trajectory(deployment, catalog("a", "d"))
+    assert "time%3E2020-01-01T02:00:00Z" in requested[2]
+
+    # A new minTime rebuilds the whole track
+    trajectories.update_trajectory(deployment, catalog("z", "d"))
+    assert "time%3E" not in requested[3]
+
+
+def test_select_tolerance():
+    from status.trajectories import select_tolerance
+    with app.app_context():
+        assert select_tolerance() == 0.02
+        assert select_tolerance(zoom=0) == 0.1
+        assert select_tolerance(zoom=6) == 0.02
+        assert select_tolerance(zoom=12) == 0.002
+        assert select_tolerance(tolerance=0.05) == 0.02
+        # Zoom is clamped, non-positive tolerances are rejected
+        assert select_tolerance(zoom=5000) == 0.002
+        assert select_tolerance(zoom=-5000) == 0.1
+        with pytest.raises(ValueError):
+            select_tolerance(tolerance=0)
+
+
+def test_track_serves_stored_trajectory(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "TRAJECTORY_DIR", str(tmp_path))
+    (tmp_path / "test_user").mkdir()
+    (tmp_path / "test_user" / "test-20200101T0000.tol0.1.json").write_text(
+        '{"type": "LineString", "coordinates": [[0, 0], [1, 1]]}')
+
+    resp = client.get("/api/track/test_user/test-20200101T0000?zoom=0")
+    assert resp.status_code == 200
+    assert resp.json["coordinates"] == [[0, 0], [1, 1]]
+    assert resp.headers["Last-Modified"]
+    etag = resp.headers["ETag"]
+    resp = client.get("/api/track/test_user/test-20200101T0000?zoom=0",
+                      headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    resp = client.get("/api/track/test_user/test-20200101T0000?tolerance=-1")
+    assert resp.status_code == 400
+
+
+def test_single_flight_shares_one_call():
+    from status.single_flight import SingleFlight
+    import threading
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def build():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "trajectory"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("a", build)))
+    leader.start()
+    started.wait()
+
+    # Release the leader once the follower is waiting on its call
+    waiting = flight._calls["a"].done.wait
+    flight._calls["a"].done.wait = lambda: (release.set(), waiting())
+    follower = threading.Thread(target=lambda: results.append(flight.do("a", build)))
+    follower.start()
+    leader.join()
+    follower.join()
+    assert results == ["trajectory", "trajectory"]
+    assert len(calls) == 1
+
+
+def test_track_encodings_round_trip():
+    from status import track_encoding
+    import numpy as np
+    rng = np.random.default_rng(0)
+    coords = np.round(np.cumsum(rng.normal(0, 0.1, (500, 2)), axis=0) +
+                      [-70, 40], 5)
+    polyline = track_encoding.encode_polyline(coords)
+    binary = track_encoding.encode_binary(coords)
+    assert np.allclose(track_encoding.decode_polyline(polyline), coords)
+    assert np.allclose(track_encoding.decode_binary(binary), coords)
+    assert len(binary) < len(json.dumps(coords.tolist())) / 4
+
+
+def test_generate_trajectories_summary(monkeypatch):
+    from status import trajectories
+    deployments = [{"name": name, "updated": 0, "completed": False}
+                   for name in ("a-20200101T0000", "b-20200101T0000",
+                                "c-20200101T0000-delayed")]
+
+    def fetch_update(deployment, catalog, rebuild):
+        if deployment["name"].startswith("b"):
+            raise ValueError("ERDDAP is down")
+        return {}, None
+
+    monkeypatch.setattr(trajectories, "iter_deployments", lambda: iter(deployments))
+    monkeypatch.setattr(trajectories, "trajectory_exists", lambda d: True)
+    monkeypatch.setattr(trajectories.ErddapCatalog, "fetch", lambda url: None)
+    monkeypatch.setattr(trajectories, "fetch_update", fetch_update)
+    monkeypatch.setattr(trajectories, "process_trajectory",
+                        lambda deployment, track, geo_data: 0.5)
+
+    summary = trajectories.generate_trajectories(cpu_workers=1)
+    assert (summary["updated"], summary["failed"], summary["skipped"]) == (1, 1, 1)
+    assert [d["status"] for d in summary["deployments"]] == ["updated", "failed"]
+    assert summary["deployments"][0]["cpu_seconds"] == 0.5
+    assert "ERDDAP is down" in summary["deployments"][1]["error"]
+
+
+def test_trajectory_task_builds_deployments_in_subtasks(monkeypatch):
+    from app import celery_app
+    from status import tasks, trajectories
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    deployments = [{"name": name, "updated": 0, "completed": False}
+                   for name in ("a-20200101T0000", "b-20200101T0000")]
+    extents = []
+
+    def fetch_update(deployment, catalog, rebuild):
+        extents.append(catalog.get(deployment["name"], "maxTime"))
+        if deployment["name"].startswith("b"):
+            raise ValueError("ERDDAP is down")
+        return {}, None
+
+    class Catalog(object):
+        def get(self, name, column):
+            return "2020-01-02T00:00:00Z"
+
+    summaries = []
+    finish_summary = tasks.finish_summary
+    monkeypatch.setattr(trajectories, "iter_deployments", lambda: iter(deployments))
+    monkeypatch.setattr(trajectories, "trajectory_exists", lambda d: True)
+    monkeypatch.setattr(tasks.ErddapCatalog, "fetch", lambda url: Catalog())
+    monkeypatch.setattr(trajectories, "fetch_update", fetch_update)
+    monkeypatch.setattr(trajectories, "process_trajectory",
+                        lambda deployment, track, geo_data: 0.5)
+    monkeypatch.setattr(tasks, "finish_summary",
+                        lambda *args: summaries.append(finish_summary(*args)))
+
+    tasks.get_trajectory_features()
+    assert extents == ["2020-01-02T00:00:00Z"] * 2
+    summary, = summaries
+    assert (summary["updated"], summary["failed"]) == (1, 1)
+    assert [d["status"] for d in summary["deployments"]] == ["updated", "failed"]
+
+
+def test_profile_frame_matches_row_loop():
+    from aws.docker.worker.generate_profile_plot import ProfileFrame, get_variables
+    import numpy as np
+    import pandas as pd
+    df = pd.DataFrame({
+        "time (UTC)": ["2020-01-01T00:00:00Z", np.nan, "2020-01-01T02:00:00Z",
+                       "2020-01-01T03:00:00Z"],
+        "depth (m)": [1.0, 2.0, np.nan, 4.0],
+        "salinity (1e-3)": [35.0, 35.1, 35.2, np.nan],
+        "temperature (Celsius)": [10.0, 11.0, 12.0, 13.0],
+    })
+    frame = ProfileFrame(df)
+    x, y, z, x_name, y_name, z_name = get_variables(df, "salinity", frame)
+    assert (x_name, y_name, z_name) == ("time (UTC)", "depth (m)", "salinity (1e-3)")
+    assert x.tolist() == list(np.array(["2020-01-01T00:00:00", "2020-01-01T02:00:00",
+                                        "2020-01-01T03:00:00"], dtype="datetime64[s]").tolist())
+    assert y.mask.tolist() == [False, True, False]
+    assert z.filled(np.nan)[:2].tolist() == [35.0, 35.2] and z.mask[2]
+    assert get_variables(df, "temperature", frame)[0] is x
+
+
+def test_bin_observations_means():
+    from aws.docker.worker.generate_profile_plot import bin_observations
+    import numpy as np
+    x = np.array(["2020-01-01T00:00:00", "2020-01-01T00:00:01",
+                  "2020-01-01T00:00:03", "2020-01-01T00:00:03"], dtype="datetime64[s]")
+    y = np.array([0.0, 0.5, 10.0, 10.0])
+    z = np.array([1.0, 3.0, 5.0, 7.0])
+    time_edges, depth_edges, grid = bin_observations(x, y, z, bins=(2, 2), fill=0)
+    assert time_edges.tolist()[0] == x[0].tolist()
+    assert depth_edges.tolist() == [0.0, 5.0, 10.0]
+    assert grid.filled(-1).tolist() == [[2.0, -1], [-1, 6.0]]
+    # Empty bins next to observations are filled from their neighbours
+    assert not bin_observations(x, y, z, bins=(2, 2), fill=1)[2].mask.any()
+
+
+def test_render_plots_returns_png_bytes(monkeypatch):
+    from aws.docker.worker import generate_profile_plot as plots
+    import numpy as np
+    import pandas as pd
+    monkeypatch.setattr(plots, "PLOT_EXECUTOR", "serial")
+    n = 200
+    df = pd.DataFrame({
+        "time (UTC)": pd.date_range("2020-01-01", periods=n, freq="min").strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "depth (m)": np.abs(np.sin(np.arange(n) / 10)) * 50,
+        "salinity (1e-3)": np.linspace(34, 36, n),
+        "temperature (Celsius)": np.linspace(10, 20, n),
+    })
+    images = plots.render_plots("test", plots.ProfileFrame(df),
+                                ["salinity", "temperature", "density"])
+    assert images["salinity"].startswith(b"\x89PNG")
+    assert images["temperature"].startswith(b"\x89PNG")
+    # A missing column fails only its own plot
+    assert isinstance(images["density"], Exception)
+
+
+def test_observation_store_fetches_only_new_rows(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from aws.docker.worker import generate_profile_plot as plots
+    import pandas as pd
+    times = ["2020-01-01T00:00:00Z", "2020-01-01T01:00:00Z",
+             "2020-01-01T02:00:00Z"]
+    upstream = {"df": pd.DataFrame({"time (UTC)": times[:2], "depth (m)": [1.0, 2.0]})}
+    calls = []
+    counts = []
+
+    def fake_fetch(dataset_id, since=None):
+        calls.append(since)
+        df = upstream["df"]
+        return df[df["time (UTC)"] > since] if since else df
+
+    def fake_count(dataset_id):
+        counts.append(dataset_id)
+        return len(upstream["df"])
+
+    monkeypatch.setattr(plots, "get_erddap_data", fake_fetch)
+    monkeypatch.setattr(plots, "get_row_count", fake_count)
+    store = plots.ObservationStore(str(tmp_path), max_parts=2)
+    first = plots.get_observations("glider", (times[0], times[1]), store, "c1")
+    assert len(first) == 2 and calls == [None]
+    # Unchanged max time and checksum are answered from the store alone
+    plots.get_observations("glider", (times[0], times[1]), store, "c1")
+    assert calls == [None] and counts == []
+    # A new checksum before ERDDAP has new rows keeps the stored rows and
+    # isn't recorded until they arrive
+    plots.get_observations("glider", (times[0], times[1]), store, "c2")
+    assert calls == [None] and len(counts) == 1
+    assert store.state("glider")["checksum"] == "c1"
+    upstream["df"] = pd.DataFrame({"time (UTC)": times, "depth (m)": [1.0, 2.0, 3.0]})
+    latest = plots.get_observations("glider", (times[0], times[2]), store, "c2")
+    assert calls == [None, times[1]]
+    assert latest["time (UTC)"].tolist() == times
+    assert store.load("glider")["time (UTC)"].tolist() == times
+    assert store.state("glider")["checksum"] == "c2"
+    # A row count that doesn't match the stored rows forces a full fetch
+    upstream["df"] = upstream["df"].iloc[[0, 2]]
+    assert len(plots.get_observations("glider", (times[0], times[2]), store, "c3")) == 2
+    assert calls[-1] is None and len(store.load("glider")) == 2
+
+
+def test_profile_plot_manifest_skips_unchanged_data(monkeypatch):
+    from aws.docker.worker import generate_profile_plot as plots
+    import io
+    import pandas as pd
+
+    class FakeObject(object):
+        def __init__(self, objects, key):
+            self.objects, self.key = objects, key
+
+        def get(self):
+            if self.key not in self.objects:
+                raise plots.botocore.exceptions.ClientError(
+                    {"Error": {"Code": "NoSuchKey"}}, "GetObject")
+            return {"Body": io.BytesIO(self.objects[self.key])}
+
+        def put(self, Body, **kwargs):
+            self.objects[self.key] = Body
+
+    class FakeS3(object):
+        objects = {}
+
+        def Object(self, bucket, key):
+            return FakeObject(self.objects, key)
+
+    monkeypatch.setattr(plots.boto3, "resource", lambda name: FakeS3())
+    df = pd.DataFrame({"time (UTC)": ["2020-01-01T00:00:00Z", "2020-01-01T01:00:00Z"],
+                       "depth (m)": [1.0, 2.0],
+                       "temperature (Celsius)": [10.0, 11.0]})
+    monkeypatch.setattr(plots, "get_observations", lambda dataset_id, extents, checksum=None: df)
+    rendered = []
+
+    def fake_render(dataset_id, frame, parameters):
+        rendered.append(list(parameters))
+        return {p: b"png" for p in parameters}
+
+    monkeypatch.setattr(plots, "render_plots", fake_render)
+    plots.generate_profile_plot("https://example.com/erddap/tabledap/glider.html")
+    plots.generate_profile_plot("https://example.com/erddap/tabledap/glider.html")
+    assert rendered == [list(plots.PARAMETERS)]
+    # Same extents and row count but different values are re-rendered
+    df.loc[1, "temperature (Celsius)"] = 12.0
+    plots.generate_profile_plot("https://example.com/erddap/tabledap/glider.html")
+    assert len(rendered) == 2
+    # A new DAC checksum re-renders even if the data fetched is the same
+    plots.generate_profile_plot("https://example.com/erddap/tabledap/glider.html", checksum="c2")
+    assert len(rendered) == 3
+    manifest = plots.load_manifest(FakeS3(), "bucket", "glider")
+    assert manifest["plots"]["temperature"]["fingerprint"]["rows"] == 2
@@ -6,12 +6,21 @@ The controller for the web stuff
 '''
 
 from web import api
-from flask import render_template, url_for
+from flask import current_app, render_template, request, url_for
+from status.publish import send_published_json
 
 @api.route('/')
 def index():
     return api.send_static_file('index.html')
 
+@api.route('/static/json/status.json')
+def status_json():
+    '''
+    Serves the published status.json, precompressed when the client accepts
+    it
+    '''
+    return send_published_json(current_app.config['STATUS_JSON'], request)
+
 @api.route('/summary')
 @api.route('/summary/')
 def summary():